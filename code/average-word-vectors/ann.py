@@ -0,0 +1,219 @@
+import argparse
+from datetime import date, datetime
+import os
+import re
+import time
+
+import numpy as np
+import polars as pl
+import pyarrow.dataset as ds
+
+from quantization import embedding_matrix
+
+
+LOCAL_INDEX_PATH = os.environ.get("LOCAL_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "indexes"))
+DEFAULT_NPROBE = int(os.environ.get("LOCAL_INDEX_NPROBE", 8))
+CHUNK_SIZE = 65536
+LOCAL_INDEXES = {}
+# Index names come from requests, they must not reach outside LOCAL_INDEX_PATH
+INDEX_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def squared_distances(vectors, centroids):
+    """Returns the squared L2 distances between every vector and every centroid"""
+    return (
+        np.einsum("ij,ij->i", vectors, vectors)[:, np.newaxis]
+        - 2 * vectors @ centroids.T
+        + np.einsum("ij,ij->i", centroids, centroids)[np.newaxis, :]
+    )
+
+
+def assign(vectors, centroids):
+    """Returns the nearest centroid of every vector, computed in chunks to bound memory"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), CHUNK_SIZE):
+        chunk = np.asarray(vectors[start:start + CHUNK_SIZE], dtype=np.float32)
+        assignments[start:start + CHUNK_SIZE] = squared_distances(chunk, centroids).argmin(axis=1)
+
+    return assignments
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Returns k-means centroids trained on a sample of the vectors"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), max(n_clusters * 256, 10000))
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign(sample, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, np.newaxis]
+        # Empty clusters are re-seeded with random sample vectors
+        empty = np.flatnonzero(~non_empty)
+        centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+
+    return centroids
+
+
+def read_embeddings(parquet_paths):
+    """Returns the documents and the float32 embedding matrix of the parquet files or directories written by utils.upload_parquet"""
+    if isinstance(parquet_paths, str):
+        parquet_paths = [parquet_paths]
+    # One dataset per path: a list of paths only accepts local files, a single path or uri can be a directory or s3 prefix
+    dataset = ds.dataset([ds.dataset(path, format="parquet") for path in parquet_paths])
+    # Read with arrow, float16 embeddings have no polars type
+    table = dataset.to_table()
+    vectors, valid = embedding_matrix(table)
+    documents = pl.from_arrow(table.select(["timestamp", "keywords"])).filter(pl.Series(valid))
+
+    return documents, np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def build_index(parquet_paths, index_path, n_lists=None, iterations=10):
+    """Builds an IVF index (k-means coarse quantizer + inverted lists) from parquet files and saves it to index_path"""
+    print(f"Reading embeddings from {parquet_paths}")
+    documents, vectors = read_embeddings(parquet_paths)
+    n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+    print(f"Building index {index_path}: {len(vectors)} vectors, {n_lists} lists")
+
+    centroids = kmeans(vectors, n_lists, iterations)
+    assignments = assign(vectors, centroids)
+    # Vectors are stored grouped by list so every probe reads one contiguous slice
+    order = np.argsort(assignments, kind="stable")
+    offsets = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+
+    os.makedirs(index_path, exist_ok=True)
+    np.save(os.path.join(index_path, "centroids.npy"), centroids)
+    np.save(os.path.join(index_path, "vectors.npy"), vectors[order])
+    np.save(os.path.join(index_path, "ids.npy"), order)
+    np.save(os.path.join(index_path, "offsets.npy"), offsets)
+    documents.write_parquet(os.path.join(index_path, "documents.parquet"))
+    print(f"Built index {index_path}")
+
+
+def json_safe(value):
+    """Returns a document value that json.dumps accepts, dates and datetimes as ISO 8601 strings"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+
+    return value
+
+
+class LocalIndex:
+    """Memory-mapped IVF index searched in-process"""
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.centroids = np.load(os.path.join(index_path, "centroids.npy"))
+        self.offsets = np.load(os.path.join(index_path, "offsets.npy"))
+        self.vectors = np.load(os.path.join(index_path, "vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(index_path, "ids.npy"), mmap_mode="r")
+        self.documents = pl.read_parquet(os.path.join(index_path, "documents.parquet"), memory_map=True)
+
+    def search(self, vector, k, nprobe=DEFAULT_NPROBE):
+        """Returns the ids and squared L2 distances of the approximate k nearest neighbours"""
+        vector = np.asarray(vector, dtype=np.float32)[np.newaxis, :]
+        probes = np.argsort(squared_distances(vector, self.centroids)[0])[:nprobe]
+        positions = np.concatenate([np.arange(self.offsets[probe], self.offsets[probe + 1]) for probe in probes])
+
+        return self._top_k(vector, positions, k)
+
+    def brute_force(self, vector, k):
+        """Returns the ids and squared L2 distances of the exact k nearest neighbours"""
+        vector = np.asarray(vector, dtype=np.float32)[np.newaxis, :]
+
+        return self._top_k(vector, np.arange(len(self.vectors)), k)
+
+    def _top_k(self, vector, positions, k):
+        """Returns the ids and squared L2 distances of the k nearest vectors at the given positions"""
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        distances = squared_distances(vector, np.asarray(self.vectors[positions]))[0]
+        k = min(k, len(distances))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+
+        return np.asarray(self.ids[positions[nearest]]), distances[nearest]
+
+    def query(self, index, size, average_word_vector, k):
+        """Returns the search results in the shape of an OpenSearch kNN response"""
+        ids, distances = self.search(average_word_vector, k)
+        hits = [
+            {
+                "_index": index,
+                "_id": str(document_id),
+                # Same scoring as the OpenSearch l2 space
+                "_score": float(1 / (1 + distance)),
+                "_source": {
+                    name: json_safe(value) for name, value in self.documents.row(int(document_id), named=True).items()
+                },
+            }
+            for document_id, distance in zip(ids[:size], distances[:size])
+        ]
+
+        return {
+            "hits": {
+                "total": {"value": len(hits), "relation": "eq"},
+                "max_score": hits[0]["_score"] if hits else None,
+                "hits": hits,
+            }
+        }
+
+
+def get_local_index(index):
+    """Returns the local index named index, loaded once per container"""
+    if index not in LOCAL_INDEXES:
+        if not isinstance(index, str) or not INDEX_NAME_PATTERN.fullmatch(index):
+            raise ValueError("Invalid index name")
+        if not os.path.isdir(os.path.join(LOCAL_INDEX_PATH, index)):
+            # The error does not echo the server path back to the client
+            raise ValueError(f"Unknown index {index}")
+        print(f"Loading local index {index}")
+        LOCAL_INDEXES[index] = LocalIndex(os.path.join(LOCAL_INDEX_PATH, index))
+        print(f"Loaded local index {index}")
+
+    return LOCAL_INDEXES[index]
+
+
+def benchmark(index_path, k=10, queries=200, nprobes=(1, 2, 4, 8, 16, 32)):
+    """Prints recall@k and mean latency of the IVF search for several nprobe values against brute force"""
+    local_index = LocalIndex(index_path)
+    rng = np.random.default_rng(0)
+    # Indexed vectors plus noise, so queries are realistic but never exact duplicates
+    sample = np.asarray(local_index.vectors[rng.choice(len(local_index.vectors), queries)])
+    sample = sample + rng.normal(0, sample.std() * 0.1, sample.shape).astype(np.float32)
+
+    start = time.perf_counter()
+    exact = [set(local_index.brute_force(vector, k)[0].tolist()) for vector in sample]
+    brute_force_ms = (time.perf_counter() - start) * 1000 / queries
+    print(f"brute force: recall@{k} 1.000, {brute_force_ms:.3f} ms/query")
+
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        found = [local_index.search(vector, k, nprobe)[0].tolist() for vector in sample]
+        elapsed_ms = (time.perf_counter() - start) * 1000 / queries
+        recall = np.mean([len(exact_ids.intersection(ids)) / len(exact_ids) for exact_ids, ids in zip(exact, found)])
+        print(f"nprobe {nprobe:>3}: recall@{k} {recall:.3f}, {elapsed_ms:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and benchmark a local IVF index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build an index from parquet files")
+    build_parser.add_argument("parquet_paths", nargs="+", help="Parquet files or directories (local paths or s3:// urls)")
+    build_parser.add_argument("--index", required=True, help="Index name, saved under LOCAL_INDEX_PATH")
+    build_parser.add_argument("--lists", type=int, default=None, help="Number of inverted lists (default sqrt(n))")
+    benchmark_parser = subparsers.add_parser("benchmark", help="Compare recall and latency against brute force")
+    benchmark_parser.add_argument("--index", required=True, help="Index name under LOCAL_INDEX_PATH")
+    benchmark_parser.add_argument("-k", type=int, default=10)
+    benchmark_parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.parquet_paths, os.path.join(LOCAL_INDEX_PATH, args.index), args.lists)
+    else:
+        benchmark(os.path.join(LOCAL_INDEX_PATH, args.index), args.k, args.queries)
@@ -1,12 +1,24 @@
 import json
+import os
 
+from bulk import bulk_transform_data
 from utils import transform_data
-from query import query_data
+from query import batch_query_data, query_data
+
+
+# Runs the query handlers on the asyncio query path (async_query.py)
+ASYNC_QUERY = os.environ.get("ASYNC_QUERY", "false").lower() == "true"
+
+if ASYNC_QUERY:
+    import async_query
 
 
 def average_word_vector(event, context):
     try:
-        transform_data(event)
+        if "source" in event or len(event.get("Records", [])) > 1:
+            bulk_transform_data(event)
+        else:
+            transform_data(event)
 
         body = {
             "message": "success"
@@ -23,7 +35,10 @@ def average_word_vector(event, context):
 
 def query(event, context):
     try:
-        query_data(event)
+        if ASYNC_QUERY:
+            async_query.run(async_query.async_query_data(event))
+        else:
+            query_data(event)
 
         return {"statusCode": 200, "body": json.dumps(event["body"])}
     except Exception as e:
@@ -32,3 +47,19 @@ def query(event, context):
         }
 
         return {"statusCode": 400, "body": json.dumps(body)}
+
+
+def batch_query(event, context):
+    try:
+        if ASYNC_QUERY:
+            results = async_query.run(async_query.async_batch_query_data(event))
+        else:
+            results = batch_query_data(event)
+
+        return {"statusCode": 200, "body": json.dumps(results)}
+    except Exception as e:
+        body = {
+            "message": "failed"
+        }
+
+        return {"statusCode": 400, "body": json.dumps(body)}
@@ -0,0 +1,137 @@
+import asyncio
+import os
+
+from opensearchpy import AsyncOpenSearch, AuthenticationException
+
+from ann import get_local_index
+from inference import EMBEDDING_CACHE, get_average_word_vector
+from query import (
+    OPENSEARCH_HOST,
+    OPENSEARCH_POOL_SIZE,
+    SEARCH_BACKEND,
+    get_batch_query_parameters,
+    get_credentials,
+    get_knn_query,
+    parse_query_parameters,
+)
+
+
+ASYNC_CONCURRENCY = int(os.environ.get("ASYNC_CONCURRENCY", 16))
+
+# One event loop per container, so the aiohttp connection pool survives between warm invocations
+LOOP = asyncio.new_event_loop()
+asyncio.set_event_loop(LOOP)
+ASYNC_OPENSEARCH_CLIENT = None
+ASYNC_CLIENT_CREDENTIALS = None
+ASYNC_CLIENT_LOCK = asyncio.Lock()
+
+
+async def get_async_opensearch_client(refresh=False):
+    """Returns the shared async OpenSearch client, only rebuilt when the credentials change"""
+    global ASYNC_OPENSEARCH_CLIENT, ASYNC_CLIENT_CREDENTIALS
+
+    async with ASYNC_CLIENT_LOCK:
+        # The (cached) SSM round trip runs in a thread so it overlaps with the embedding
+        credentials = await asyncio.to_thread(get_credentials, refresh)
+
+        if ASYNC_OPENSEARCH_CLIENT is None or credentials != ASYNC_CLIENT_CREDENTIALS:
+            if ASYNC_OPENSEARCH_CLIENT is not None:
+                await ASYNC_OPENSEARCH_CLIENT.close()
+            use_ssl = OPENSEARCH_HOST.startswith("https")
+            ASYNC_OPENSEARCH_CLIENT = AsyncOpenSearch(
+                hosts=OPENSEARCH_HOST,
+                http_compress=True,
+                http_auth=credentials,
+                use_ssl=use_ssl,
+                verify_certs=use_ssl,
+                pool_maxsize=OPENSEARCH_POOL_SIZE,
+            )
+            ASYNC_CLIENT_CREDENTIALS = credentials
+
+        return ASYNC_OPENSEARCH_CLIENT
+
+
+async def async_search(client_task, index, size, average_word_vector, k):
+    """Returns the kNN response of the configured search backend"""
+    if SEARCH_BACKEND == "local":
+        return await asyncio.to_thread(get_local_index(index).query, index, size, average_word_vector, k)
+
+    query = get_knn_query(size, average_word_vector, k)
+    client = await client_task
+
+    try:
+        return await client.search(body = query, index = index)
+    except AuthenticationException:
+        print("OpenSearch authentication failed, refreshing credentials")
+        client = await get_async_opensearch_client(refresh=True)
+
+        return await client.search(body = query, index = index)
+
+
+def start_client_task():
+    """Starts fetching the OpenSearch client in the background, or returns None for the local backend"""
+    if SEARCH_BACKEND == "local":
+        return None
+
+    return asyncio.ensure_future(get_async_opensearch_client())
+
+
+def finish_client_task(client_task):
+    """Cancels the client set up when no search awaited it, so no task is left pending on the shared loop"""
+    if client_task is None:
+        return
+    if not client_task.done():
+        client_task.cancel()
+    elif not client_task.cancelled():
+        # Retrieved, so a failed set up is not reported as an exception never retrieved
+        client_task.exception()
+
+
+async def async_query_data(event):
+    """Query data process steps, embedding and client set up run concurrently"""
+    index, size, keywords, k = parse_query_parameters(event)
+    client_task = start_client_task()
+    try:
+        average_word_vector = await asyncio.to_thread(get_average_word_vector, keywords)
+        response = await async_search(client_task, index, size, average_word_vector, k)
+    finally:
+        finish_client_task(client_task)
+    print(f"Embedding cache: {EMBEDDING_CACHE.stats()}")
+
+    return response
+
+
+async def async_batch_query_data(event):
+    """Batch query data process steps, searches run concurrently and results keep the input order"""
+    client_task = start_client_task()
+    try:
+        return await batch_search(client_task, event)
+    finally:
+        # e.g. every item failed validation and nothing awaited the client
+        finish_client_task(client_task)
+
+
+async def batch_search(client_task, event):
+    """Returns the result or error of every batch item, in input order"""
+    items = await asyncio.to_thread(get_batch_query_parameters, event)
+    semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY)
+
+    async def run_item(item):
+        if "error" in item:
+            return {"error": item["error"]}
+        async with semaphore:
+            try:
+                response = await async_search(client_task, item["index"], item["size"], item["average_word_vector"], item["k"])
+                return {"response": response}
+            except Exception as e:
+                return {"error": str(e)}
+
+    results = await asyncio.gather(*[run_item(item) for item in items])
+    print(f"Embedding cache: {EMBEDDING_CACHE.stats()}")
+
+    return results
+
+
+def run(coroutine):
+    """Runs a coroutine on the container event loop from synchronous handlers"""
+    return LOOP.run_until_complete(coroutine)
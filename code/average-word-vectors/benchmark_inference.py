@@ -0,0 +1,64 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from inference import EMBEDDING_CACHE, MODEL, embed_word_lists, process_word
+
+
+def per_word_average(word_list):
+    """Average vector of a list of words using the per-word path (regex split and clean, one lookup per sub-word)"""
+    vectors = [vec for vec in map(process_word, word_list) if vec is not None]
+
+    return np.mean(vectors, axis=0) if vectors else None
+
+
+def make_word_lists(lists, words_per_list, seed=0):
+    """Returns keyword lists mixing plain words, hyphen/underscore compounds and out-of-vocabulary forms"""
+    rng = random.Random(seed)
+    vocabulary = MODEL.index_to_key[:50000]
+
+    def make_word():
+        kind = rng.random()
+        if kind < 0.6:
+            return rng.choice(vocabulary)
+        if kind < 0.9:
+            return rng.choice("-_ ").join(rng.sample(vocabulary, 2))
+        return "".join(rng.choice("bcdfghjklmnpqrstvwxz") for _ in range(12))
+
+    return [[make_word() for _ in range(words_per_list)] for _ in range(lists)]
+
+
+def benchmark(lists, words_per_list):
+    """Prints the time to embed the keyword lists with the per-word path and with the normalization table"""
+    word_lists = make_word_lists(lists, words_per_list)
+
+    start = time.perf_counter()
+    expected = [per_word_average(word_list) for word_list in word_lists]
+    per_word_seconds = time.perf_counter() - start
+    print(f"per-word path:       {per_word_seconds:.3f} s ({lists / per_word_seconds:.0f} lists/s)")
+
+    # Cold embedding cache so only the normalization table and the gather-and-reduce are measured
+    EMBEDDING_CACHE.clear()
+    EMBEDDING_CACHE.maxsize = 0
+    start = time.perf_counter()
+    vectors, found = embed_word_lists(word_lists)
+    table_seconds = time.perf_counter() - start
+    print(f"normalization table: {table_seconds:.3f} s ({lists / table_seconds:.0f} lists/s), {per_word_seconds / table_seconds:.1f}x")
+
+    max_error = max(
+        float(np.abs(vector - expected_vector).max())
+        for vector, is_found, expected_vector in zip(vectors, found, expected)
+        if is_found and expected_vector is not None
+    )
+    print(f"max absolute difference: {max_error:.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the per-word embedding path with the normalization table")
+    parser.add_argument("--lists", type=int, default=10000)
+    parser.add_argument("--words", type=int, default=8)
+    args = parser.parse_args()
+
+    benchmark(args.lists, args.words)
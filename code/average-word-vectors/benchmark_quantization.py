@@ -0,0 +1,77 @@
+import argparse
+import io
+
+import numpy as np
+import polars as pl
+import pyarrow.parquet as pq
+
+from benchmark_inference import make_word_lists
+from inference import MODEL, embed_word_lists, get_rows
+from quantization import DTYPES, dequantize, embedding_matrix, quantize_int8, quantize_table
+
+
+def cosine_similarities(expected, actual):
+    """Returns the cosine similarity of every pair of rows"""
+    norms = np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+    norms[norms == 0] = 1.0
+
+    return np.einsum("ij,ij->i", expected, actual) / norms
+
+
+def quantize_matrix(matrix, dtype):
+    """Returns the matrix stored as dtype and converted back to float32, and its storage size in bytes"""
+    if dtype == "float16":
+        stored = matrix.astype(np.float16)
+        return dequantize(stored), stored.nbytes
+    if dtype == "int8":
+        stored, scales = quantize_int8(matrix)
+        return dequantize(stored, scales), stored.nbytes + scales.nbytes
+
+    return matrix, matrix.nbytes
+
+
+def parquet_size(table):
+    """Returns the size in bytes of an arrow table written as parquet"""
+    sink = io.BytesIO()
+    pq.write_table(table, sink)
+
+    return sink.tell()
+
+
+def print_drift(name, dtype, size, reference_size, similarities):
+    """Prints the size ratio and cosine similarity drift of a storage mode"""
+    print(
+        f"{name} {dtype:>7}: {size / 1024 / 1024:8.1f} MiB ({size / reference_size:.2f}x), "
+        f"cosine mean {similarities.mean():.6f}, min {similarities.min():.6f}"
+    )
+
+
+def benchmark(lists, words_per_list):
+    """Prints size and cosine similarity drift against float32 for the model and the parquet output"""
+    # Model rows, measured against the float32 model
+    model_vectors = get_rows(np.arange(len(MODEL.index_to_key)))
+    for dtype in DTYPES:
+        vectors, size = quantize_matrix(model_vectors, dtype)
+        print_drift("model ", dtype, size, model_vectors.nbytes, cosine_similarities(model_vectors, vectors))
+
+    # Average word vectors, written and read back as parquet
+    vectors, found = embed_word_lists(make_word_lists(lists, words_per_list))
+    vectors = vectors[found]
+    table = pl.DataFrame({"keywords_embedding": vectors}).with_columns(
+        pl.col("keywords_embedding").cast(pl.List(pl.Float32))
+    ).to_arrow(compat_level=pl.CompatLevel.oldest())
+    reference_size = parquet_size(table)
+    for dtype in DTYPES:
+        quantized_table = quantize_table(table, dtype, MODEL.vector_size)
+        restored, _ = embedding_matrix(quantized_table)
+        print_drift("output", dtype, parquet_size(quantized_table), reference_size, cosine_similarities(vectors, restored))
+
+
+if __name__ == "__main__":
+    # Run against the float32 binary model so the reference is exact
+    parser = argparse.ArgumentParser(description="Size and accuracy of the reduced precision storage modes")
+    parser.add_argument("--lists", type=int, default=100000)
+    parser.add_argument("--words", type=int, default=8)
+    args = parser.parse_args()
+
+    benchmark(args.lists, args.words)
@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+
+import numpy as np
+
+import async_query
+from query import query_data
+
+
+def percentiles(latencies):
+    """Returns the p50 and p99 latencies in milliseconds"""
+    return np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+
+def timed_sync(event):
+    """Returns the latency of a synchronous query"""
+    start = time.perf_counter()
+    query_data(event)
+    return time.perf_counter() - start
+
+
+async def timed_async(event):
+    """Returns the latency of an asynchronous query"""
+    start = time.perf_counter()
+    await async_query.async_query_data(event)
+    return time.perf_counter() - start
+
+
+async def run_async(events, concurrency):
+    """Runs the queries on the asyncio path with at most concurrency in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_event(event):
+        async with semaphore:
+            return await timed_async(event)
+
+    return await asyncio.gather(*[run_event(event) for event in events])
+
+
+def benchmark(index, keywords, requests, concurrency):
+    """Prints p50/p99 latency and throughput of the sync (thread pool) and async query paths"""
+    events = [
+        {"body": json.dumps({"index": index, "keywords": keywords[i % len(keywords):] + keywords[:i % len(keywords)], "k": 3, "size": 3})}
+        for i in range(requests)
+    ]
+    # Warm up the model pages, the cache and the clients
+    query_data(events[0])
+    async_query.run(async_query.async_query_data(events[0]))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(timed_sync, events))
+    elapsed = time.perf_counter() - start
+    p50, p99 = percentiles(latencies)
+    print(f"sync:  p50 {p50:.1f} ms, p99 {p99:.1f} ms, {requests / elapsed:.1f} requests/s")
+
+    start = time.perf_counter()
+    latencies = async_query.run(run_async(events, concurrency))
+    elapsed = time.perf_counter() - start
+    p50, p99 = percentiles(latencies)
+    print(f"async: p50 {p50:.1f} ms, p99 {p99:.1f} ms, {requests / elapsed:.1f} requests/s")
+
+
+if __name__ == "__main__":
+    # Point OPENSEARCH_HOST/OPENSEARCH_AUTH at a local stand-in, or set SEARCH_BACKEND=local
+    parser = argparse.ArgumentParser(description="Query latency under concurrent load")
+    parser.add_argument("--index", default="average-word-vectors")
+    parser.add_argument("--keywords", nargs="+", default=["test", "demo", "search", "vector"])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    benchmark(args.index, args.keywords, args.requests, args.concurrency)
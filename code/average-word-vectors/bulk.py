@@ -0,0 +1,128 @@
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import os
+import urllib.parse
+
+import boto3
+
+from inference import MODEL
+from utils import UPLOAD_BUCKET, UPLOAD_PART_SIZE, get_upload_key, stream_transform_file
+
+
+# Lambda has no /dev/shm, so a process pool cannot be created there
+ON_LAMBDA = "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", 1 if ON_LAMBDA else os.cpu_count() or 1))
+
+
+def list_sources(source, s3_client=None):
+    """Returns the gzip files of a local directory or of an s3://bucket/prefix listing"""
+    if not source.startswith("s3://"):
+        return sorted(
+            os.path.join(root, filename)
+            for root, _, filenames in os.walk(source)
+            for filename in filenames
+            if filename.endswith(".gz")
+        )
+
+    bucket, _, prefix = source[len("s3://"):].partition("/")
+    paginator = (s3_client or boto3.client("s3")).get_paginator("list_objects_v2")
+
+    return [
+        f"s3://{bucket}/{item['Key']}"
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+        for item in page.get("Contents", [])
+        if item["Key"].endswith(".gz")
+    ]
+
+
+def get_event_sources(event):
+    """Returns the gzip files of every record of an s3 event, or of the "source" directory/prefix of a backfill event"""
+    if "source" in event:
+        return list_sources(event["source"])
+
+    return [
+        f"s3://{record['s3']['bucket']['name']}/{urllib.parse.unquote_plus(record['s3']['object']['key'], encoding='utf-8')}"
+        for record in event["Records"]
+        if record["s3"]["object"]["key"].endswith(".gz")
+    ]
+
+
+def get_target(source_url, target=None):
+    """Returns the parquet file of a source file, in the target directory or in the upload bucket"""
+    if target is None:
+        key = source_url[len("s3://"):].partition("/")[2] if source_url.startswith("s3://") else os.path.basename(source_url)
+        return f"s3://{UPLOAD_BUCKET}/{get_upload_key(key)}"
+
+    filename = f'{os.path.basename(source_url).split(".")[0]}.parquet'
+
+    return f"{target.rstrip('/')}/{filename}"
+
+
+def init_worker():
+    """Logs the worker start up, the memory-mapped model comes from the parent through fork (or the import under spawn)"""
+    print(f"Worker {os.getpid()} ready, model rows: {len(MODEL.index_to_key)}")
+
+
+def process_file(source_url, target_url):
+    """Streams one gzip file into one parquet file (download, embedding and upload are pipelined)"""
+    transport_params = {"min_part_size": UPLOAD_PART_SIZE} if target_url.startswith("s3://") else None
+
+    return stream_transform_file(source_url, target_url, transport_params)
+
+
+def bulk_transform(sources, target=None, workers=BULK_WORKERS):
+    """Transforms many gzip files with a process pool, returns the number of rows of every file (or its error)"""
+    results = {}
+    if workers <= 1:
+        # Runs in process, e.g. where multiprocessing is not available (AWS Lambda has no /dev/shm)
+        for source_url in sources:
+            try:
+                results[source_url] = process_file(source_url, get_target(source_url, target))
+            except Exception as e:
+                print(f"Something went wrong processing {source_url}: {e}")
+                results[source_url] = e
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        pending = {}
+        sources = iter(sources)
+        while True:
+            # At most two files per worker are queued, so listings of any size use bounded memory
+            for source_url in sources:
+                pending[executor.submit(process_file, source_url, get_target(source_url, target))] = source_url
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                source_url = pending.pop(future)
+                try:
+                    results[source_url] = future.result()
+                except Exception as e:
+                    print(f"Something went wrong processing {source_url}: {e}")
+                    results[source_url] = e
+
+    return results
+
+
+def bulk_transform_data(event):
+    """Bulk transforming data process steps, for s3 events with many records or backfill events with a source"""
+    sources = get_event_sources(event)
+    print(f"Processing {len(sources)} files")
+    results = bulk_transform(sources, event.get("target"))
+    failed = [source_url for source_url, result in results.items() if isinstance(result, Exception)]
+    print(f"Processed {len(results) - len(failed)} files, {len(failed)} failed")
+    if failed:
+        raise Exception(f"Failed to process {failed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transform many gzip exports in parallel")
+    parser.add_argument("source", help="Local directory or s3://bucket/prefix of gzip exports")
+    parser.add_argument("--target", default=None, help="Local directory or s3:// prefix (default: the upload bucket)")
+    parser.add_argument("--workers", type=int, default=BULK_WORKERS)
+    args = parser.parse_args()
+
+    results = bulk_transform(list_sources(args.source), args.target, args.workers)
+    print(f"Processed {sum(1 for result in results.values() if not isinstance(result, Exception))}/{len(results)} files")
@@ -0,0 +1,40 @@
+import argparse
+import os
+
+from gensim import models
+import numpy as np
+
+from quantization import DTYPES, quantize_int8
+
+
+SOURCE_PATH = "s3://gensim/models/glove-wiki-gigaword-300.txt"
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "glove-wiki-gigaword-300.kv")
+
+
+def convert_model(source_path, model_path, dtype="float32"):
+    """Converts a GloVe text model into a binary store (dtype vectors .npy + vocabulary index) that can be memory-mapped"""
+    print(f"Loading text model {source_path}")
+    model = models.KeyedVectors.load_word2vec_format(source_path, datatype=np.float32)
+    print(f"Loaded text model {source_path}: {len(model.index_to_key)} words, {model.vector_size} dimensions")
+
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    if dtype == "float16":
+        model.vectors = model.vectors.astype(np.float16)
+    elif dtype == "int8":
+        # Per-row scales are stored next to the int8 vectors
+        model.vectors, scales = quantize_int8(model.vectors)
+        np.save(f"{model_path}.scales.npy", scales)
+
+    # Large arrays are written next to the index as {model_path}.vectors.npy so they can be opened with mmap
+    model.save(model_path, sep_limit=0)
+    print(f"Saved binary model {model_path} ({dtype}, {model.vectors.nbytes} bytes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the GloVe text model into a memory-mappable binary store")
+    parser.add_argument("--source", default=SOURCE_PATH, help="GloVe text model (local path or s3:// url)")
+    parser.add_argument("--target", default=MODEL_PATH, help="Binary model output path")
+    parser.add_argument("--dtype", default="float32", choices=DTYPES, help="Storage type of the vectors")
+    args = parser.parse_args()
+
+    convert_model(args.source, args.target, args.dtype)
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import uuid
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from inference import normalize_word_list
+
+
+# Directory of parquet files on local disk or s3://bucket/prefix, so the table outlives Lambda containers.
+# Keys depend on the model vocabulary so use one table per model
+EMBEDDING_TABLE_PATH = os.environ.get("EMBEDDING_TABLE_PATH")
+EMBEDDING_TABLES = {}
+TABLE_SCHEMA = {"key": pl.Binary, "keywords_embedding": pl.List(pl.Float32)}
+
+
+def keywords_key(keywords):
+    """Returns the content address of a keywords JSON value: a digest of its normalized Text keyword list"""
+    text = json.loads(keywords)["Text"]
+    # Empty and null lists embed as zeros, unknown-only lists as null, so empty and null lists are flagged
+    normalized = (not text, normalize_word_list(text))
+
+    return hashlib.blake2b(repr(normalized).encode(), digest_size=16).digest()
+
+
+def get_filesystem(path):
+    """Returns the arrow filesystem and root directory of a local path or s3:// url"""
+    if "://" in path:
+        return pafs.FileSystem.from_uri(path)
+
+    return pafs.LocalFileSystem(), os.path.abspath(path)
+
+
+class EmbeddingTable:
+    """Persistent content-addressed table of average word vectors, stored as append-only parquet part files"""
+
+    def __init__(self, path):
+        self.path = path
+        self.filesystem, self.root = get_filesystem(path)
+        self.filesystem.create_dir(self.root, recursive=True)
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, keys):
+        """Returns the stored keys and vectors (null for lists without a known word) among keys"""
+        stored = [pl.DataFrame(schema=TABLE_SCHEMA)] + [df.filter(pl.col("key").is_in(keys)) for df in self.pending]
+        try:
+            dataset = ds.dataset(self.root, filesystem=self.filesystem, format="parquet")
+        except FileNotFoundError:
+            dataset = None
+        if dataset is not None and dataset.files:
+            table = dataset.to_table(filter=ds.field("key").isin(pa.array(keys.to_list(), type=pa.binary())))
+            stored.append(pl.from_arrow(table).select(list(TABLE_SCHEMA)).cast(TABLE_SCHEMA))
+
+        # Concurrent writers may have stored the same key twice, with the same vector
+        return pl.concat(stored).unique("key")
+
+    def store(self, vectors):
+        """Keeps new keys and vectors until the next flush"""
+        if vectors.height:
+            self.pending.append(vectors.select(list(TABLE_SCHEMA)).cast(TABLE_SCHEMA))
+
+    def flush(self):
+        """Writes the new vectors as one new part file, parts are never rewritten so concurrent writers do not conflict"""
+        if not self.pending:
+            return
+        vectors = pl.concat(self.pending).unique("key")
+        part = f"{self.root}/part-{uuid.uuid4()}.parquet"
+        pq.write_table(vectors.to_arrow(), part, filesystem=self.filesystem)
+        self.pending = []
+        print(f"Stored {vectors.height} vectors in embedding table {self.path}")
+
+    def embed(self, df, embed):
+        """Adds the keywords_embedding column, only calling embed on the rows of keyword lists not in the table"""
+        unique = df.select(pl.col("keywords").drop_nulls().unique())
+        unique = unique.with_columns(pl.Series("key", [keywords_key(keywords) for keywords in unique["keywords"]], dtype=pl.Binary))
+        stored = self.lookup(unique["key"])
+
+        unseen = unique.filter(~pl.col("key").is_in(stored["key"])).unique("key")
+        if unseen.height:
+            embedded = embed(unseen).select(list(TABLE_SCHEMA))
+            self.store(embedded)
+            stored = pl.concat([stored, embedded.cast(TABLE_SCHEMA)])
+        self.hits += unique.height - unseen.height
+        self.misses += unseen.height
+
+        return (
+            df.join(unique, on="keywords", how="left")
+            .join(stored, on="key", how="left")
+            .drop("key")
+        )
+
+    def stats(self):
+        """Returns the number of keyword lists found in and added to the table"""
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def get_embedding_table():
+    """Returns this process' embedding table, None when EMBEDDING_TABLE_PATH is not set"""
+    if not EMBEDDING_TABLE_PATH:
+        return None
+    if EMBEDDING_TABLE_PATH not in EMBEDDING_TABLES:
+        print(f"Opening embedding table {EMBEDDING_TABLE_PATH}")
+        EMBEDDING_TABLES[EMBEDDING_TABLE_PATH] = EmbeddingTable(EMBEDDING_TABLE_PATH)
+
+    return EMBEDDING_TABLES[EMBEDDING_TABLE_PATH]
@@ -1,37 +1,147 @@
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 import json
+import os
 import re
+import threading
+import time
 
 from gensim import models
 import numpy as np
 
+from quantization import dequantize
 
-#  TODO: Can we load this outside of handler to persist between lambda invocations when possible
-print("Loading GloVe model")
-MODEL = models.KeyedVectors.load_word2vec_format("s3://gensim/models/glove-wiki-gigaword-300.txt")
-print("GloVe model loaded")
+
+SOURCE_PATH = "s3://gensim/models/glove-wiki-gigaword-300.txt"
+MODEL_PATH = os.environ.get(
+    "MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "glove-wiki-gigaword-300.kv")
+)
+
+
+def load_model():
+    """Opens the binary model read-only and memory-mapped, falling back to parsing the GloVe text model"""
+    if os.path.exists(MODEL_PATH):
+        print(f"Loading GloVe model {MODEL_PATH} (memory-mapped)")
+        # Pages are shared between every process mapping the same file
+        model = models.KeyedVectors.load(MODEL_PATH, mmap="r")
+    else:
+        print(f"Binary model {MODEL_PATH} not found, loading GloVe text model {SOURCE_PATH}")
+        model = models.KeyedVectors.load_word2vec_format(SOURCE_PATH, datatype=np.float32)
+    print(f"GloVe model loaded ({model.vectors.dtype})")
+
+    return model
+
+
+def load_scales():
+    """Returns the row scales of an int8 binary model, None for float32/float16 models"""
+    if MODEL.vectors.dtype == np.int8:
+        return np.load(f"{MODEL_PATH}.scales.npy", mmap_mode="r")
+
+    return None
+
+
+# Loaded outside of the handler so it persists between lambda invocations
+MODEL = load_model()
+SCALES = load_scales()
+
+
+# Sub-words are the runs between underscores, hyphens and whitespace
+TOKEN_PATTERN = re.compile(r'[^_\-\s]+')
+CLEAN_PATTERN = re.compile(r'[^a-zA-Z0-9]')
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", 100000))
+EMBEDDING_CACHE_TTL = float(os.environ.get("EMBEDDING_CACHE_TTL", 3600))
+# Upper bound of the surface form table (precomputed vocabulary compounds plus forms seen at runtime)
+SURFACE_FORMS_SIZE = int(os.environ.get("SURFACE_FORMS_SIZE", 1000000))
+
+
+class EmbeddingCache:
+    """Bounded LRU cache of average vectors keyed by normalized word lists, entries expire after ttl seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value for key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl <= 0 or time.monotonic() - entry[0] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Stores value for key, evicting the least recently used entries above maxsize"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Removes every entry and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Returns the cache counters"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+EMBEDDING_CACHE = EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL)
 
 
 def clean_word(word):
     """Clean a word by removing unnecessary characters."""
-    return re.sub(r'[^a-zA-Z0-9]', '', word)
+    return CLEAN_PATTERN.sub('', word)
+
+
+def tokenize(word):
+    """Split a word on underscores, hyphens and whitespace and clean the sub-words."""
+    return [clean_word(sub_word) for sub_word in TOKEN_PATTERN.findall(word)]
+
+
+def get_rows(row_ids):
+    """Returns the float32 vectors of the given model rows, whatever the storage type of the model"""
+    row_ids = np.asarray(row_ids)
+
+    return dequantize(MODEL.vectors[row_ids], SCALES[row_ids] if SCALES is not None else None)
 
 
 def get_word_vector(word):
     """Retrieve the vector for a given word from the model."""
-    try:
-        return MODEL.get_vector(word)
-    except KeyError:
+    row = MODEL.key_to_index.get(word)
+    if row is None:
         return None
 
+    return get_rows([row])[0]
+
 
 def process_word(word):
     """Process a single word: clean, split, and get vectors for sub-words."""
-    sub_words = re.split(r'[_\-\s]', word)
-    cleaned_sub_words = [clean_word(sub_word) for sub_word in sub_words if sub_word]
     vectors = []
 
-    for sub_word in cleaned_sub_words:
+    for sub_word in tokenize(word):
         vec = get_word_vector(sub_word)
         if vec is not None:
             vectors.append(vec)
@@ -44,6 +154,128 @@ def process_word(word):
         return np.mean(vectors, axis=0)
 
 
+def build_surface_forms():
+    """
+    Returns the surface form table built once when the model loads.
+
+    Plain ASCII alphanumeric words are looked up directly in the model vocabulary,
+    the table holds the row ids of every other vocabulary entry (hyphen/underscore
+    compounds, punctuation) so those never go through the regular expressions.
+    """
+    key_to_index = MODEL.key_to_index
+    surface_forms = {}
+
+    for key in MODEL.index_to_key:
+        if not (key.isascii() and key.isalnum()):
+            surface_forms[key] = tuple(key_to_index[sub_word] for sub_word in tokenize(key) if sub_word in key_to_index)
+
+    return surface_forms
+
+
+def resolve_word(word):
+    """Returns the row ids of the known sub-words of a word, an empty tuple for out-of-vocabulary words"""
+    if word.isascii() and word.isalnum():
+        # Nothing to split or clean
+        row = MODEL.key_to_index.get(word)
+        return (row,) if row is not None else ()
+
+    rows = SURFACE_FORMS.get(word)
+    if rows is None:
+        key_to_index = MODEL.key_to_index
+        rows = tuple(key_to_index[sub_word] for sub_word in tokenize(word) if sub_word in key_to_index)
+        # Out-of-vocabulary forms are kept too (empty tuple) as a negative cache
+        if len(SURFACE_FORMS) < SURFACE_FORMS_SIZE:
+            SURFACE_FORMS[word] = rows
+
+    return rows
+
+
+def normalize_word_list(word_list):
+    """Returns the cache key of a list of words: the sorted tuple of the sub-word row ids of every known word"""
+    return tuple(sorted(rows for rows in map(resolve_word, word_list or ()) if rows))
+
+
+SURFACE_FORMS = build_surface_forms()
+
+
+def average_normalized_word_lists(normalized_lists):
+    """
+    Get the average vectors for many normalized word lists with a single gather-and-reduce.
+
+    Every sub-word row is weighted so that the weighted sum equals the mean of the
+    per-word means computed by process_word.
+
+    :param normalized_lists: list of normalized word lists (see normalize_word_list)
+    :return: (vectors, found) where vectors is a (len(normalized_lists), vector_size) float32 array
+             and found is a boolean array, False for lists without a single known word (zero rows)
+    """
+    row_ids = []
+    weights = []
+    segments = []
+    found = np.zeros(len(normalized_lists), dtype=bool)
+
+    for list_index, word_rows in enumerate(normalized_lists):
+        for rows in word_rows:
+            weight = 1.0 / (len(rows) * len(word_rows))
+            row_ids.extend(rows)
+            weights.extend([weight] * len(rows))
+            segments.extend([list_index] * len(rows))
+        found[list_index] = bool(word_rows)
+
+    vectors = np.zeros((len(normalized_lists), MODEL.vector_size), dtype=np.float32)
+    if row_ids:
+        gathered = get_rows(row_ids) * np.asarray(weights, dtype=np.float32)[:, np.newaxis]
+        # Segments are contiguous, so every list is reduced with a single reduceat call
+        segments = np.asarray(segments)
+        starts = np.flatnonzero(np.diff(segments, prepend=-1))
+        vectors[segments[starts]] = np.add.reduceat(gathered, starts, axis=0)
+
+    return vectors, found
+
+
+def embed_word_lists(word_lists):
+    """
+    Get the average vectors for many lists of words, only computing the lists missing from the cache.
+
+    :param word_lists: list of lists of words
+    :return: (vectors, found) where vectors is a (len(word_lists), vector_size) float32 array
+             and found is a boolean array, False for lists without a single known word (zero rows)
+    """
+    keys = [normalize_word_list(word_list) for word_list in word_lists]
+    vectors = np.zeros((len(keys), MODEL.vector_size), dtype=np.float32)
+    found = np.zeros(len(keys), dtype=bool)
+    missing = {}
+
+    for index, key in enumerate(keys):
+        cached = EMBEDDING_CACHE.get(key)
+        if cached is not None:
+            vectors[index], found[index] = cached
+        else:
+            missing.setdefault(key, []).append(index)
+
+    if missing:
+        missing_keys = list(missing)
+        missing_vectors, missing_found = average_normalized_word_lists(missing_keys)
+        for key, vector, key_found in zip(missing_keys, missing_vectors, missing_found):
+            # A copy, a row view would keep the whole batch array alive while the key stays cached
+            EMBEDDING_CACHE.put(key, (vector.copy(), bool(key_found)))
+            vectors[missing[key]] = vector
+            found[missing[key]] = key_found
+
+    return vectors, found
+
+
+def get_average_word_vectors(word_lists):
+    """
+    Get the average vector for each list of words.
+
+    :param word_lists: list of lists of words
+    :return: 2-D float32 array, one average vector per list (zeros when no word is known)
+    """
+    vectors, _ = embed_word_lists(word_lists)
+    return vectors
+
+
 def get_average_word_vector(word_list):
     """
     Get the average vector for a list of words.
@@ -51,16 +283,9 @@ def get_average_word_vector(word_list):
     :param word_list: list of words
     :return: average vector of the words in the list
     """
+    vectors, found = embed_word_lists([word_list])
 
-    with ThreadPoolExecutor() as executor:
-        # Parallelize the processing of words
-        all_vectors = list(executor.map(process_word, word_list))
-
-    # Flatten the list of lists and filter out any empty lists
-    vectors = [vec for vec in all_vectors if isinstance(vec, np.ndarray) and vec.size > 0]
-
-    if vectors:
-        average_vector = np.mean(vectors, axis=0)
-        return average_vector.tolist()
+    if found[0]:
+        return vectors[0].tolist()
     else:
-        return  None
+        return None
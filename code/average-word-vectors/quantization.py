@@ -0,0 +1,74 @@
+import numpy as np
+import pyarrow as pa
+
+
+DTYPES = ("float32", "float16", "int8")
+
+
+def quantize_int8(matrix):
+    """Returns the symmetric per-row int8 quantization of a float matrix and the float32 scale of every row"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(matrix / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+
+    return quantized, scales.astype(np.float32)
+
+
+def dequantize(matrix, scales=None):
+    """Returns the float32 matrix of a float16/float32 matrix or of an int8 matrix and its row scales"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if scales is not None:
+        matrix = matrix * np.asarray(scales, dtype=np.float32)[:, np.newaxis]
+
+    return matrix
+
+
+def quantize_table(table, dtype, dimensions, column="keywords_embedding"):
+    """
+    Returns the arrow table with its list<float32> embedding column stored as a fixed size list of dimensions dtype values.
+
+    Parquet cannot store null fixed size lists, so null embeddings are written as zeros and a {column}_valid
+    boolean column tells them apart. int8 adds a {column}_scale float32 column holding the scale of every row.
+    """
+    if dtype == "float32":
+        return table
+
+    embeddings = table.column(column).combine_chunks()
+    valid = embeddings.is_valid().to_numpy(zero_copy_only=False)
+    values = embeddings.flatten().to_numpy(zero_copy_only=False)
+    matrix = np.zeros((len(embeddings), dimensions), dtype=np.float32)
+    matrix[valid] = values.reshape(-1, dimensions)
+
+    if dtype == "float16":
+        quantized = pa.FixedSizeListArray.from_arrays(pa.array(matrix.astype(np.float16).ravel()), dimensions)
+        table = table.set_column(table.schema.get_field_index(column), column, quantized)
+    else:
+        quantized, scales = quantize_int8(matrix)
+        table = table.set_column(
+            table.schema.get_field_index(column),
+            column,
+            pa.FixedSizeListArray.from_arrays(pa.array(quantized.ravel()), dimensions),
+        )
+        table = table.append_column(f"{column}_scale", pa.array(scales))
+
+    return table.append_column(f"{column}_valid", pa.array(valid, type=pa.bool_()))
+
+
+def embedding_matrix(table, column="keywords_embedding"):
+    """Returns the float32 embedding matrix of the non-null rows of an arrow table in any of the storage dtypes"""
+    embeddings = table.column(column).combine_chunks()
+    if f"{column}_valid" in table.column_names:
+        # Fixed size storage, null embeddings are zero rows flagged in the validity column
+        valid = table.column(f"{column}_valid").to_numpy(zero_copy_only=False).astype(bool)
+        values = embeddings.flatten().to_numpy(zero_copy_only=False)
+        matrix = values.reshape(len(embeddings), -1)[valid] if len(values) else np.zeros((0, 0), dtype=np.float32)
+    else:
+        valid = embeddings.is_valid().to_numpy(zero_copy_only=False)
+        values = embeddings.flatten().to_numpy(zero_copy_only=False)
+        matrix = values.reshape(int(valid.sum()), -1) if len(values) else np.zeros((0, 0), dtype=np.float32)
+    scales = None
+    if f"{column}_scale" in table.column_names:
+        scales = table.column(f"{column}_scale").to_numpy(zero_copy_only=False)[valid]
+
+    return dequantize(matrix, scales), valid
@@ -1,15 +1,36 @@
 import ast
 import json
+import os
+import threading
+import time
 
 import boto3
 import botocore
-from opensearchpy import OpenSearch
+from opensearchpy import AuthenticationException, OpenSearch
 
-from inference import get_average_word_vector
+from ann import get_local_index
+from inference import EMBEDDING_CACHE, embed_word_lists, get_average_word_vector
 
 
-def get_query_parameters(event):
-    """Returns the query parameters """
+OPENSEARCH_HOST = os.environ.get("OPENSEARCH_HOST", "https://search-dev-us.aos.us-east-1.on.aws")
+OPENSEARCH_AUTH_PARAMETER = os.environ.get("OPENSEARCH_AUTH_PARAMETER", "/dev-us-opensearch/auth")
+# Credentials given as a tuple literal, e.g. "('admin', 'admin')", skip SSM (local stand-ins)
+OPENSEARCH_AUTH = os.environ.get("OPENSEARCH_AUTH")
+OPENSEARCH_POOL_SIZE = int(os.environ.get("OPENSEARCH_POOL_SIZE", 10))
+CREDENTIALS_REFRESH_SECONDS = int(os.environ.get("CREDENTIALS_REFRESH_SECONDS", 900))
+# "opensearch" (managed cluster) or "local" (in-process IVF index, see ann.py)
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "opensearch")
+
+# Module level state persists between warm lambda invocations
+SSM_CLIENT = None
+CREDENTIALS = None
+CREDENTIALS_FETCHED_AT = 0.0
+OPENSEARCH_CLIENT = None
+CLIENT_LOCK = threading.Lock()
+
+
+def parse_query_parameters(event):
+    """Returns the query parameters before embedding the keywords"""
     body_data = json.loads(event["body"])
     if "index" not in body_data:
         print("Missing index parameter")
@@ -21,33 +42,115 @@ def get_query_parameters(event):
     index = body_data.get("index")
     size = body_data.get("size", 1)
     keywords = body_data.get("keywords")
-    average_word_vector = get_average_word_vector(keywords)
     k = body_data.get("k", 3)
 
+    return index, size, keywords, k
+
+
+def get_query_parameters(event):
+    """Returns the query parameters """
+    index, size, keywords, k = parse_query_parameters(event)
+    average_word_vector = get_average_word_vector(keywords)
+
     return index, size, average_word_vector, k
 
 
-def get_opensearch_client():
-    """Creates and returns an OpenSearch client """
-    host = "https://search-dev-us.aos.us-east-1.on.aws" #  TODO: Config file?
-    ssm_client = boto3.client("ssm")
-    auth = ssm_client.get_parameter(
-        Name="/dev-us-opensearch/auth",
+def get_batch_query_parameters(event):
+    """Returns the batch query items, each with its index, size, average word vector and k, or an error"""
+    body_data = json.loads(event["body"])
+    if isinstance(body_data, dict):
+        body_data = body_data.get("queries")
+    if not isinstance(body_data, list):
+        print("Missing queries parameter")
+        raise Exception("Missing queries parameter")
+
+    items = []
+    for item in body_data:
+        if not isinstance(item, dict):
+            items.append({"error": "Query must be an object"})
+        elif "index" not in item:
+            items.append({"error": "Missing index parameter"})
+        elif "keywords" not in item:
+            items.append({"error": "Missing keywords parameter"})
+        elif not isinstance(item["keywords"], list) or not all(isinstance(keyword, str) for keyword in item["keywords"]):
+            # A string would be embedded one character at a time
+            items.append({"error": "Keywords parameter must be an array of strings"})
+        else:
+            items.append({
+                "index": item.get("index"),
+                "size": item.get("size", 1),
+                "keywords": item.get("keywords"),
+                "k": item.get("k", 3),
+            })
+
+    # Every valid item is embedded in a single vectorized pass
+    valid_items = [item for item in items if "error" not in item]
+    vectors, found = embed_word_lists([item["keywords"] for item in valid_items])
+    for item, vector, item_found in zip(valid_items, vectors, found):
+        if item_found:
+            item["average_word_vector"] = vector.tolist()
+        else:
+            item["error"] = "No known keywords"
+
+    return items
+
+
+def fetch_credentials():
+    """Returns the OpenSearch credentials from the environment or SSM"""
+    global SSM_CLIENT
+
+    if OPENSEARCH_AUTH:
+        return ast.literal_eval(OPENSEARCH_AUTH)
+
+    if SSM_CLIENT is None:
+        SSM_CLIENT = boto3.client("ssm")
+    auth = SSM_CLIENT.get_parameter(
+        Name=OPENSEARCH_AUTH_PARAMETER,
         WithDecryption=True
     )
 
-    return OpenSearch(
-        hosts=host,
-        http_compress=True,
-        http_auth=ast.literal_eval(auth["Parameter"]["Value"]),
-        use_ssl=True,
-        verify_certs=True,
-    )
+    return ast.literal_eval(auth["Parameter"]["Value"])
 
 
-def opensearch_query(index, size, average_word_vector, k):
-    """Returns the OpenSearch query response"""
-    query = {
+def get_credentials(refresh=False):
+    """Returns the cached OpenSearch credentials, fetched again once they are older than the refresh interval"""
+    global CREDENTIALS, CREDENTIALS_FETCHED_AT
+
+    if refresh or CREDENTIALS is None or time.monotonic() - CREDENTIALS_FETCHED_AT > CREDENTIALS_REFRESH_SECONDS:
+        CREDENTIALS = fetch_credentials()
+        CREDENTIALS_FETCHED_AT = time.monotonic()
+
+    return CREDENTIALS
+
+
+def get_opensearch_client(refresh=False):
+    """Returns the shared OpenSearch client, only rebuilt (new connection pool) when the credentials change"""
+    global OPENSEARCH_CLIENT
+
+    with CLIENT_LOCK:
+        previous_credentials = CREDENTIALS
+        credentials = get_credentials(refresh)
+
+        if OPENSEARCH_CLIENT is None or credentials != previous_credentials:
+            if OPENSEARCH_CLIENT is not None:
+                OPENSEARCH_CLIENT.close()
+            use_ssl = OPENSEARCH_HOST.startswith("https")
+            OPENSEARCH_CLIENT = OpenSearch(
+                hosts=OPENSEARCH_HOST,
+                http_compress=True,
+                http_auth=credentials,
+                use_ssl=use_ssl,
+                verify_certs=use_ssl,
+                # Keep-alive connections are reused across warm invocations
+                pool_maxsize=OPENSEARCH_POOL_SIZE,
+            )
+
+        return OPENSEARCH_CLIENT
+
+
+def get_knn_query(size, average_word_vector, k):
+    """Returns the OpenSearch kNN query body"""
+    return {
       "size": size,
       "query": {
         "knn": {
@@ -58,16 +161,98 @@ def opensearch_query(index, size, average_word_vector, k):
         }
       }
     }
+
+
+def opensearch_query(index, size, average_word_vector, k):
+    """Returns the OpenSearch query response"""
+    query = get_knn_query(size, average_word_vector, k)
     opensearch_client = get_opensearch_client()
 
-    return opensearch_client.search(
-        body = query,
-        index = index
-    )
+    try:
+        return opensearch_client.search(
+            body = query,
+            index = index
+        )
+    except AuthenticationException:
+        # The credentials were rotated before the refresh interval, fetch them again and retry once
+        print("OpenSearch authentication failed, refreshing credentials")
+        opensearch_client = get_opensearch_client(refresh=True)
+
+        return opensearch_client.search(
+            body = query,
+            index = index
+        )
+
+
+def opensearch_msearch(items):
+    """Returns the OpenSearch responses of a single _msearch request, in the order of the items"""
+    body = []
+    for item in items:
+        body.append({"index": item["index"]})
+        body.append(get_knn_query(item["size"], item["average_word_vector"], item["k"]))
+    opensearch_client = get_opensearch_client()
+
+    try:
+        response = opensearch_client.msearch(body = body)
+    except AuthenticationException:
+        print("OpenSearch authentication failed, refreshing credentials")
+        opensearch_client = get_opensearch_client(refresh=True)
+        response = opensearch_client.msearch(body = body)
+
+    return response["responses"]
+
+
+def local_msearch(items):
+    """Returns the local index responses of every item, in the order of the items"""
+    responses = []
+    for item in items:
+        try:
+            responses.append(search(item["index"], item["size"], item["average_word_vector"], item["k"]))
+        except Exception as e:
+            responses.append({"error": str(e)})
+
+    return responses
+
+
+def search(index, size, average_word_vector, k):
+    """Returns the kNN response of the configured search backend"""
+    if SEARCH_BACKEND == "local":
+        return get_local_index(index).query(index, size, average_word_vector, k)
+
+    return opensearch_query(index, size, average_word_vector, k)
+
+
+def msearch(items):
+    """Returns the kNN responses of the configured search backend, in the order of the items"""
+    if SEARCH_BACKEND == "local":
+        return local_msearch(items)
+
+    return opensearch_msearch(items)
+
+
+def batch_query_data(event):
+    """Batch query data process steps, returns one result or error per query in input order"""
+    items = get_batch_query_parameters(event)
+    searches = [item for item in items if "error" not in item]
+    responses = msearch(searches) if searches else []
+
+    for item, response in zip(searches, responses):
+        if "error" in response:
+            item["error"] = response["error"]
+        else:
+            item["response"] = response
+
+    print(f"Embedding cache: {EMBEDDING_CACHE.stats()}")
+
+    return [
+        {"error": item["error"]} if "error" in item else {"response": item["response"]}
+        for item in items
+    ]
 
 
 def query_data(event):
     """Query data process steps"""
     index, size, average_word_vector, k = get_query_parameters(event)
-    response = opensearch_query(index, size, average_word_vector, k)
+    response = search(index, size, average_word_vector, k)
     print(response) #  TODO: What should we do with the response?
+    print(f"Embedding cache: {EMBEDDING_CACHE.stats()}")
@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+from gensim.models import KeyedVectors
+import numpy as np
+
+
+# A tiny model saved before the modules under test load MODEL_PATH at import time
+WORDS = ["coffee", "bagel", "large", "cream", "cheese"]
+MODEL_DIR = tempfile.mkdtemp()
+TEST_MODEL = KeyedVectors(vector_size=4)
+TEST_MODEL.add_vectors(WORDS, np.arange(len(WORDS) * 4, dtype=np.float32).reshape(len(WORDS), 4) + 1)
+TEST_MODEL.save(os.path.join(MODEL_DIR, "test.kv"))
+os.environ["MODEL_PATH"] = os.path.join(MODEL_DIR, "test.kv")
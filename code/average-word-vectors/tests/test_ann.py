@@ -0,0 +1,52 @@
+from datetime import datetime
+import json
+
+import numpy as np
+import polars as pl
+import pytest
+
+import ann
+from ann import LocalIndex, build_index, get_local_index
+
+
+def test_local_index_query_is_json_serializable(tmp_path):
+    vectors = np.random.default_rng(0).normal(size=(20, 4)).astype(np.float32)
+    pl.DataFrame({
+        "timestamp": [datetime(2024, 1, 1, 0, 0, index) for index in range(20)],
+        "keywords": ['{"Text": ["coffee"]}'] * 20,
+        "keywords_embedding": vectors.tolist(),
+    }, schema_overrides={"keywords_embedding": pl.List(pl.Float32)}).write_parquet(tmp_path / "embeddings.parquet")
+    build_index([str(tmp_path / "embeddings.parquet")], str(tmp_path / "index"), n_lists=2)
+
+    response = LocalIndex(str(tmp_path / "index")).query("test", 3, vectors[5], 3)
+
+    hits = json.loads(json.dumps(response))["hits"]["hits"]
+    assert hits[0]["_id"] == "5"
+    assert hits[0]["_source"]["timestamp"] == "2024-01-01T00:00:05"
+
+
+def test_build_index_from_directory(tmp_path):
+    vectors = np.random.default_rng(0).normal(size=(10, 4)).astype(np.float32)
+    (tmp_path / "embeddings").mkdir()
+    pl.DataFrame({
+        "timestamp": ["2024-01-01 00:00:00"] * 10,
+        "keywords": ['{"Text": ["coffee"]}'] * 10,
+        "keywords_embedding": vectors.tolist(),
+    }, schema_overrides={"keywords_embedding": pl.List(pl.Float32)}).write_parquet(tmp_path / "embeddings" / "export.parquet")
+
+    build_index([str(tmp_path / "embeddings")], str(tmp_path / "index"), n_lists=2)
+
+    assert len(LocalIndex(str(tmp_path / "index")).vectors) == 10
+
+
+@pytest.mark.parametrize("index", ["../indexes", "/etc", "", 5])
+def test_get_local_index_rejects_invalid_names(index):
+    with pytest.raises(ValueError, match="Invalid index name"):
+        get_local_index(index)
+
+
+def test_get_local_index_unknown_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(ann, "LOCAL_INDEX_PATH", str(tmp_path))
+
+    with pytest.raises(ValueError, match="^Unknown index missing$"):
+        get_local_index("missing")
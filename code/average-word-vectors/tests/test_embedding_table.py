@@ -0,0 +1,36 @@
+import json
+
+import polars as pl
+import pytest
+
+import utils
+from embedding_table import EmbeddingTable, keywords_key
+
+
+def test_keywords_key_empty_and_null_lists():
+    empty = keywords_key(json.dumps({"Text": []}))
+    null = keywords_key(json.dumps({"Text": None}))
+    unknown = keywords_key(json.dumps({"Text": ["unknown"]}))
+
+    # Empty and null lists embed as zeros, unknown-only lists as null
+    assert empty == null
+    assert null != unknown
+    assert keywords_key(json.dumps({"Text": ["bagel", "coffee"]})) == keywords_key(json.dumps({"Text": ["coffee", "bagel"]}))
+
+
+def test_embedding_table_embeds_unseen_lists_once(tmp_path):
+    rows = pl.DataFrame({"keywords": [json.dumps({"Text": text}) for text in (["coffee"], ["bagel", "coffee"], ["coffee"], [], ["unknown"])]})
+    embedded = utils.embed_rows(rows)
+
+    table = EmbeddingTable(str(tmp_path / "table"))
+    first = table.embed(rows, utils.embed_rows)
+    table.flush()
+    assert table.stats() == {"hits": 0, "misses": 4}
+
+    # A new process reads the vectors back from the part files
+    reopened = EmbeddingTable(str(tmp_path / "table"))
+    second = reopened.embed(rows, lambda df: pytest.fail("nothing left to embed"))
+    assert reopened.stats() == {"hits": 4, "misses": 0}
+
+    assert first["keywords_embedding"].to_list() == embedded["keywords_embedding"].to_list()
+    assert second["keywords_embedding"].to_list() == embedded["keywords_embedding"].to_list()
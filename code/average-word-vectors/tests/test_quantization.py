@@ -0,0 +1,21 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from quantization import embedding_matrix, quantize_table
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantize_table_with_null_embedding(tmp_path, dtype):
+    vectors = [[1.0, -2.0, 3.0], None, [0.5, 0.25, -1.0]]
+    table = pa.table({
+        "keywords": ["a", "b", "c"],
+        "keywords_embedding": pa.array(vectors, type=pa.list_(pa.float32())),
+    })
+
+    pq.write_table(quantize_table(table, dtype, 3), tmp_path / "embeddings.parquet")
+    matrix, valid = embedding_matrix(pq.read_table(tmp_path / "embeddings.parquet"))
+
+    assert valid.tolist() == [True, False, True]
+    np.testing.assert_allclose(matrix, [vectors[0], vectors[2]], atol=0.02)
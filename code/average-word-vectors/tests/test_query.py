@@ -0,0 +1,25 @@
+import json
+
+from query import get_batch_query_parameters
+
+
+def test_batch_query_parameters_errors_per_item():
+    event = {"body": json.dumps([
+        {"index": "test", "keywords": ["coffee"]},
+        {"index": "test", "keywords": 5},
+        {"index": "test", "keywords": "coffee"},
+        {"index": "test", "keywords": ["coffee", 5]},
+        {"keywords": ["coffee"]},
+        {"index": "test", "keywords": ["unknown"]},
+    ])}
+
+    items = get_batch_query_parameters(event)
+
+    assert "average_word_vector" in items[0] and "error" not in items[0]
+    assert [item.get("error") for item in items[1:]] == [
+        "Keywords parameter must be an array of strings",
+        "Keywords parameter must be an array of strings",
+        "Keywords parameter must be an array of strings",
+        "Missing index parameter",
+        "No known keywords",
+    ]
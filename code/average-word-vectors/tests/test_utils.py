@@ -0,0 +1,80 @@
+import csv
+import gzip
+import json
+from unittest.mock import MagicMock
+
+import numpy as np
+import polars as pl
+import pytest
+
+import utils
+from conftest import TEST_MODEL
+
+
+def write_export(path, texts):
+    """Writes a gzip csv export with one row per Text value"""
+    with gzip.open(path, "wt", newline="") as fp:
+        writer = csv.writer(fp)
+        writer.writerow(["timestamp", "keywords", "source"])
+        for index, text in enumerate(texts):
+            writer.writerow([f"2024-01-01 00:00:0{index}", json.dumps({"Text": text}), "test"])
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_transform_csv_data_upload_parquet(tmp_path, monkeypatch, columnar):
+    download_path = tmp_path / "export.gz"
+    upload_path = tmp_path / "export.parquet"
+    write_export(download_path, [["coffee", "cream-cheese"], [], ["unknown"], None])
+    monkeypatch.setattr(utils, "DOWNLOAD_PATH", str(download_path))
+    monkeypatch.setattr(utils, "UPLOAD_PATH", str(upload_path))
+    monkeypatch.setattr(utils, "COLUMNAR_EMBEDDING", columnar)
+    s3_client = MagicMock()
+
+    utils.upload_parquet(s3_client, utils.transform_csv_data(), "bad/export.gz")
+
+    s3_client.upload_file.assert_called_once_with(str(upload_path), utils.UPLOAD_BUCKET, utils.get_upload_key("bad/export.gz"))
+    df = pl.read_parquet(upload_path)
+    assert df.columns == ["timestamp", "keywords", "keywords_embedding"]
+    embeddings = {repr(json.loads(keywords)["Text"]): vector for keywords, vector in df.select("keywords", "keywords_embedding").iter_rows()}
+    # Mean of the keywords, a compound keyword is the mean of its sub-words
+    expected = np.mean([TEST_MODEL["coffee"], np.mean([TEST_MODEL["cream"], TEST_MODEL["cheese"]], axis=0)], axis=0)
+    np.testing.assert_allclose(embeddings["['coffee', 'cream-cheese']"], expected, rtol=1e-6)
+    assert embeddings["[]"] == [0.0] * 4
+    assert embeddings["['unknown']"] is None
+    assert embeddings["None"] == [0.0] * 4
+
+
+def test_stream_transform_file(tmp_path):
+    source = tmp_path / "export.gz"
+    target = tmp_path / "export.parquet"
+    write_export(source, [["coffee", "cream-cheese"], [], ["unknown"], None])
+
+    rows = utils.stream_transform_file(str(source), str(target))
+
+    assert rows == 4
+    df = pl.read_parquet(target)
+    # Same schema as the default path
+    assert df.schema["timestamp"] == pl.String
+    assert df["timestamp"].to_list() == ["2024-01-01 00:00:00", "2024-01-01 00:00:01", "2024-01-01 00:00:02", "2024-01-01 00:00:03"]
+    # Empty and null Text values embed as zeros like the baseline
+    assert df["keywords_embedding"].to_list()[1:] == [[0.0] * 4, None, [0.0] * 4]
+
+
+def test_stream_transform_file_quantized(tmp_path, monkeypatch):
+    source = tmp_path / "export.gz"
+    target = tmp_path / "export.parquet"
+    write_export(source, [["coffee"], ["unknown"]])
+    monkeypatch.setattr(utils, "OUTPUT_DTYPE", "int8")
+
+    utils.stream_transform_file(str(source), str(target))
+
+    df = pl.read_parquet(target)
+    assert df["keywords_embedding_valid"].to_list() == [True, False]
+
+
+def test_embed_rows_in_slices(monkeypatch):
+    df = pl.DataFrame({"keywords": [json.dumps({"Text": text}) for text in (["coffee"], ["bagel"], [], ["unknown"], ["large"])]})
+    expected = utils.embed_rows(df)
+    monkeypatch.setattr(utils, "EMBED_BATCH_SIZE", 2)
+
+    assert utils.embed_rows(df).equals(expected)
@@ -1,21 +1,46 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
 import os
+import queue
+import threading
 import urllib.parse
 import uuid
 
 import boto3
 import botocore
+import numpy as np
 import polars as pl
 import gzip
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import smart_open
 
-from inference import get_average_word_vector
+from embedding_table import get_embedding_table
+from inference import EMBEDDING_CACHE, MODEL, embed_word_lists, get_rows
+from quantization import quantize_table
 
 
 UPLOAD_BUCKET = "average-word-vector"
 UPLOAD_KEY = "word_embeddings"
 DOWNLOAD_PATH = f"/tmp/{uuid.uuid4()}.gz"
 UPLOAD_PATH = f"/tmp/{uuid.uuid4()}.parquet"
+KEYWORDS_DTYPE = pl.Struct({"Text": pl.List(pl.String)})
+VOCABULARY = None
+# Streaming mode reads, embeds and writes one record batch (parquet row group) at a time
+STREAMING = os.environ.get("STREAMING", "false").lower() == "true"
+STREAM_BLOCK_SIZE = int(os.environ.get("STREAM_BLOCK_SIZE", 8 * 1024 * 1024))
+UPLOAD_PART_SIZE = int(os.environ.get("UPLOAD_PART_SIZE", 8 * 1024 * 1024))
+# Number of record batches buffered between the download, embedding and upload stages
+PIPELINE_DEPTH = int(os.environ.get("PIPELINE_DEPTH", 2))
+# Rows embedded per gather, the gathered sub-word vectors take about 1.2 kB each
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 10000))
+# Opt-in columnar embedding inside the polars plan, it copies the vocabulary into a DataFrame (no shared mmap)
+COLUMNAR_EMBEDDING = os.environ.get("COLUMNAR_EMBEDDING", "false").lower() == "true"
+# float32 keeps the List(Float32) column, float16 and int8 write fixed size arrays (int8 adds a scale column)
+OUTPUT_DTYPE = os.environ.get("OUTPUT_DTYPE", "float32")
 
 
 def get_bucket_and_key(event):
@@ -43,14 +68,72 @@ def key_exists(s3_client, bucket, key):
 
 
 def my_custom_polars_function(keywords_embedding):
-    """Returns a string representation of the average word vector for Text keyword values found in the keywords_embedding column"""
-    jsonified = json.loads(keywords_embedding)
-    if jsonified["Text"]:
-        result = get_average_word_vector(jsonified["Text"])
-    else:
-        result = [0.0] * 300
+    """Returns the average word vectors for Text keyword values found in a chunk of the keywords_embedding column"""
+    texts = [json.loads(keywords)["Text"] if keywords is not None else None for keywords in keywords_embedding]
+    vectors, found = embed_word_lists(texts)
 
-    return result
+    # Empty or null Text values keep their zero vector, Text values without a single known word are null
+    keep = pl.Series(
+        [keywords is not None and bool(found[index] or not text) for index, (keywords, text) in enumerate(zip(keywords_embedding, texts))],
+        dtype=pl.Boolean,
+    )
+    result = pl.Series(keywords_embedding.name, vectors).cast(pl.List(pl.Float32))
+
+    return result.zip_with(keep, pl.Series(keywords_embedding.name, [None] * len(texts), dtype=pl.List(pl.Float32)))
+
+
+def get_vocabulary():
+    """Returns the vocabulary index as a LazyFrame with a token column and one Float32 column per vector dimension"""
+    global VOCABULARY
+
+    if VOCABULARY is None:
+        print("Building vocabulary DataFrame")
+        vectors = get_rows(np.arange(len(MODEL.index_to_key)))
+        columns = {"token": MODEL.index_to_key}
+        columns.update({f"v{dimension}": vectors[:, dimension] for dimension in range(MODEL.vector_size)})
+        VOCABULARY = pl.DataFrame(columns).lazy()
+        print("Built vocabulary DataFrame")
+
+    return VOCABULARY
+
+
+def embed_keywords(lf):
+    """Adds a keywords_embedding column with the average word vector of the Text keyword values as lazy columnar operations"""
+    dimensions = [f"v{dimension}" for dimension in range(MODEL.vector_size)]
+    lf = lf.with_row_index("row_nr")
+
+    embeddings = (
+        lf.select("row_nr", pl.col("keywords").str.json_decode(KEYWORDS_DTYPE).struct.field("Text").alias("word"))
+        # One row per keyword, numbered so sub-words can be averaged per keyword first
+        .explode("word")
+        .with_row_index("word_nr")
+        # Split on underscores, hyphens and whitespace, then clean the sub-words
+        .with_columns(pl.col("word").str.extract_all(r"[^_\-\s]+").alias("token"))
+        .explode("token")
+        .with_columns(pl.col("token").str.replace_all(r"[^a-zA-Z0-9]", ""))
+        .join(get_vocabulary(), on="token", how="inner")
+        # Mean of the sub-words of each keyword, then mean of the keywords of each row
+        .group_by("row_nr", "word_nr")
+        .agg(pl.col(dimensions).mean())
+        .group_by("row_nr")
+        .agg(pl.col(dimensions).mean())
+        .select("row_nr", pl.concat_list(dimensions).cast(pl.List(pl.Float32)).alias("keywords_embedding"))
+    )
+
+    zero_vector = pl.concat_list([pl.lit(0.0, dtype=pl.Float32)] * MODEL.vector_size)
+    text_length = pl.col("keywords").str.json_decode(KEYWORDS_DTYPE).struct.field("Text").list.len()
+
+    return (
+        lf.join(embeddings, on="row_nr", how="left")
+        # Rows with an empty or null Text get a zero vector, rows without a single known keyword stay null
+        .with_columns(
+            pl.when(text_length.fill_null(0) == 0)
+            .then(zero_vector)
+            .otherwise(pl.col("keywords_embedding"))
+            .alias("keywords_embedding")
+        )
+        .drop("row_nr")
+    )
 
 
 def download_gzip(s3_client, bucket, key):
@@ -65,41 +148,181 @@ def download_gzip(s3_client, bucket, key):
 
 
 def transform_csv_data():
-    """Removed unwanted columns and added a new column keywords_embedding with the string representation of the average word vector"""
-    df = (
+    """Removed unwanted columns and added a new column keywords_embedding with the average word vector"""
+    lf = (
         pl.scan_csv(DOWNLOAD_PATH)
         # Select the columns we want
         .select("timestamp", "keywords")
-        # Collect the data in chucks
-        .collect(streaming=True)
     )
 
-    # copy the keywords row data into a new keywords_embedding column
-    df = df.with_columns(pl.col("keywords").alias("keywords_embedding"))
-    # Replace the keywords_embedding row data with the average word vector
-    df  = df.with_columns(pl.col("keywords_embedding").map_elements(my_custom_polars_function, return_dtype=pl.List(pl.Float32)))
+    if COLUMNAR_EMBEDDING and get_embedding_table() is None:
+        # Lazy plan, collected by upload_parquet
+        return embed_keywords(lf)
 
-    return df
+    # Collect the data in chucks, then embed whole column chunks with the vectorized gather
+    return embed_batch(lf.collect(streaming=True))
 
 
-def upload_parquet(s3_client, df, filename):
-    """Uploads a parquet file to s3"""
+def get_upload_key(filename):
+    """Returns the date partitioned upload key of the parquet file for a source file"""
     current_date= datetime.now().strftime("%Y-%m-%d")
     current_datetime_string = str(current_date)
     filename = f'{filename.split(".")[0]}.parquet'
 
+    return f"{UPLOAD_KEY}/{current_datetime_string}/{filename}"
+
+
+def embed_rows(df):
+    """Adds the keywords_embedding column computed from the keywords column, EMBED_BATCH_SIZE rows at a time"""
+    if df.height <= EMBED_BATCH_SIZE:
+        return df.with_columns(my_custom_polars_function(df["keywords"]).alias("keywords_embedding"))
+
+    # Slices bound the gathered sub-word matrix, which is much larger than the averaged vectors
+    return pl.concat([embed_rows(df.slice(start, EMBED_BATCH_SIZE)) for start in range(0, df.height, EMBED_BATCH_SIZE)])
+
+
+def embed_batch(df):
+    """Adds the keywords_embedding column to a batch of rows, reusing the embedding table when it is enabled"""
+    embedding_table = get_embedding_table()
+    if embedding_table is None:
+        return embed_rows(df)
+
+    return embedding_table.embed(df, embed_rows)
+
+
+def flush_embedding_table():
+    """Writes the vectors embedded since the last flush to the embedding table when it is enabled"""
+    embedding_table = get_embedding_table()
+    if embedding_table is not None:
+        embedding_table.flush()
+
+
+def to_output_table(df):
+    """Returns the arrow table written to parquet, with the embeddings stored as OUTPUT_DTYPE"""
+    return quantize_table(df.to_arrow(compat_level=pl.CompatLevel.oldest()), OUTPUT_DTYPE, MODEL.vector_size)
+
+
+def prefetch(iterable, depth=PIPELINE_DEPTH):
+    """Yields the items of iterable, produced ahead by a background thread through a bounded queue"""
+    items = queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((None, e))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def stream_transform(source, sink, block_size=STREAM_BLOCK_SIZE, depth=PIPELINE_DEPTH):
+    """
+    Streams csv rows from a file object into parquet row groups written to a file object, one record batch at a time.
+
+    Reading (download and decompression), embedding and writing (upload) run as pipelined stages
+    with at most depth record batches buffered between them.
+    """
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        # Strings like the polars path, arrow would otherwise infer timestamp as a datetime
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=["timestamp", "keywords"],
+            column_types={"timestamp": pa.string(), "keywords": pa.string()},
+        ),
+    )
+    # The csv schema is inferred from the first block, so the parquet schema is known before any row is embedded
+    empty = embed_batch(pl.from_arrow(reader.schema.empty_table()))
+    schema = to_output_table(empty).schema
+    rows = 0
+
+    with pq.ParquetWriter(sink, schema) as writer, ThreadPoolExecutor(max_workers=1) as upload:
+        pending = []
+        for batch in prefetch(reader, depth):
+            df = embed_batch(pl.from_arrow(batch))
+            pending.append(upload.submit(writer.write_table, to_output_table(df).cast(schema)))
+            rows += df.height
+            # A single writer thread keeps the row groups in order, waiting bounds the buffered tables
+            while len(pending) > depth:
+                pending.pop(0).result()
+        for write in pending:
+            write.result()
+
+    return rows
+
+
+def stream_transform_file(source_url, target_url, transport_params=None):
+    """Streams a gzip csv file into a parquet file, both can be local paths or s3:// urls"""
+    print(f"Streaming {source_url} to {target_url}")
+    # smart_open decompresses .gz while reading and sends s3 writes as a multipart upload
+    with smart_open.open(source_url, "rb", transport_params=transport_params) as source, \
+            smart_open.open(target_url, "wb", transport_params=transport_params) as sink:
+        rows = stream_transform(source, sink)
+    flush_embedding_table()
+    print(f"Streamed {rows} rows from {source_url} to {target_url}")
+
+    return rows
+
+
+def transform_data_streaming(s3_client, bucket, key):
+    """Streams a gzip file from s3 into a parquet file on s3 with bounded memory and no temporary files"""
+    transport_params = {"client": s3_client, "min_part_size": UPLOAD_PART_SIZE}
+
+    try:
+        stream_transform_file(f"s3://{bucket}/{key}", f"s3://{UPLOAD_BUCKET}/{get_upload_key(key)}", transport_params)
+    except Exception as e:
+        print(f"Something went wrong streaming {bucket}/{key}: {e}")
+        raise
+
+
+def upload_parquet(s3_client, df, filename):
+    """Uploads a parquet file to s3"""
+    upload_key = get_upload_key(filename)
+
     try:
         print(f"Saving data to file: {UPLOAD_PATH}")
-        df.write_parquet(UPLOAD_PATH)
+        if isinstance(df, pl.LazyFrame):
+            # The streaming engine cannot sink the joins and group_bys of the columnar stage, collect then write
+            df = df.collect(streaming=True)
+        if OUTPUT_DTYPE != "float32":
+            # Polars has no float16 type, quantized embeddings are written from arrow
+            pq.write_table(to_output_table(df), UPLOAD_PATH)
+        else:
+            df.write_parquet(UPLOAD_PATH)
         print(f"Saved data to file: {UPLOAD_PATH}")
     except Exception as e:
         print(f"Something went saving file {UPLOAD_PATH}: {e}")
         raise
 
     try:
-        print(f"Uploading {UPLOAD_PATH} to {UPLOAD_BUCKET}/{UPLOAD_KEY}/{current_datetime_string}/{filename}")
-        response = s3_client.upload_file(UPLOAD_PATH, UPLOAD_BUCKET, f"{UPLOAD_KEY}/{current_datetime_string}/{filename}")
-        print(f"Uploaded {UPLOAD_PATH} to {UPLOAD_BUCKET}/{UPLOAD_KEY}/{current_datetime_string}/{filename}")
+        print(f"Uploading {UPLOAD_PATH} to {UPLOAD_BUCKET}/{upload_key}")
+        response = s3_client.upload_file(UPLOAD_PATH, UPLOAD_BUCKET, upload_key)
+        print(f"Uploaded {UPLOAD_PATH} to {UPLOAD_BUCKET}/{upload_key}")
     except Exception as e:
         print(f"Something went wrong uploading to s3: {e}")
         raise
@@ -117,6 +340,13 @@ def clean_up():
         raise
 
 
+def print_embedding_table_stats():
+    """Prints the embedding table counters when it is enabled"""
+    embedding_table = get_embedding_table()
+    if embedding_table is not None:
+        print(f"Embedding table: {embedding_table.stats()}")
+
+
 def transform_data(event):
     """Transforming data process steps"""
     s3_client = boto3.client("s3")
@@ -125,12 +355,29 @@ def transform_data(event):
     if key_exists(s3_client, bucket, key):
         if key.endswith(".csv"):
             pass
+        elif key.endswith(".gz") and STREAMING:
+            print("Processing file (streaming)")
+            transform_data_streaming(s3_client, bucket, key)
+            print(f"Processed file, embedding cache: {EMBEDDING_CACHE.stats()}")
+            print_embedding_table_stats()
         elif key.endswith(".gz"):
             print("Processing file")
             download_gzip(s3_client, bucket, key)
             df = transform_csv_data()
             upload_parquet(s3_client, df, key)
+            flush_embedding_table()
             clean_up()
-            print("Processed file")
+            print(f"Processed file, embedding cache: {EMBEDDING_CACHE.stats()}")
+            print_embedding_table_stats()
         else:
             print("Error!")
+
+
+if __name__ == "__main__":
+    # Runs the streaming transform on local files, e.g. python utils.py export.gz export.parquet
+    parser = argparse.ArgumentParser(description="Stream a gzip csv export into a parquet file")
+    parser.add_argument("source", help="gzip csv file (local path or s3:// url)")
+    parser.add_argument("target", help="parquet file (local path or s3:// url)")
+    args = parser.parse_args()
+
+    stream_transform_file(args.source, args.target)
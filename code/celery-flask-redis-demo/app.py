@@ -1,8 +1,17 @@
 import os
+import json
+import hashlib
+import hmac
 import logging
+import queue
+import smtplib
+import threading
+import time
+from collections import OrderedDict
 
 from celery import Celery
-from flask import Flask, request, render_template, session, redirect, url_for, jsonify
+import redis
+from flask import Flask, request, render_template, session, redirect, url_for, jsonify, Response, stream_with_context
 from flask_httpauth import HTTPBasicAuth
 from flask_mail import Mail, Message
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -18,14 +27,41 @@ auth = HTTPBasicAuth()
 app.config['CELERY_BROKER_URL'] = 'redis://localhost:6379/0'
 app.config['CELERY_RESULT_BACKEND'] = 'redis://localhost:6379/0'
 
+# Result handling configuration
+app.config['CELERY_RESULT_EXPIRES'] = int(os.environ.get('CELERY_RESULT_EXPIRES', 3600))
+app.config['CELERY_SERIALIZER'] = os.environ.get('CELERY_SERIALIZER', 'msgpack')
+app.config['EMAIL_IGNORE_RESULT'] = os.environ.get('EMAIL_IGNORE_RESULT', 'false').lower() == 'true'
+app.config['FINAL_STATE_TTL'] = int(os.environ.get('FINAL_STATE_TTL', 300))
+
 # Initialize Celery
-celery = Celery(app.name, broker=app.config['CELERY_BROKER_URL'])
+celery = Celery(app.name, broker=app.config['CELERY_BROKER_URL'], backend=app.config['CELERY_RESULT_BACKEND'])
+celery.conf.update(
+    result_expires=app.config['CELERY_RESULT_EXPIRES'],
+    task_serializer=app.config['CELERY_SERIALIZER'],
+    result_serializer=app.config['CELERY_SERIALIZER'],
+    accept_content=['json', 'msgpack'],
+)
+
+# Initialize Redis (pending receipt emails)
+redis_client = redis.Redis.from_url(app.config['CELERY_BROKER_URL'])
+
+# Batched email dispatch configuration
+app.config['EMAIL_BATCH_ENABLED'] = os.environ.get('EMAIL_BATCH_ENABLED', 'false').lower() == 'true'
+app.config['EMAIL_BATCH_SIZE'] = int(os.environ.get('EMAIL_BATCH_SIZE', 50))
+app.config['EMAIL_BATCH_WAIT'] = int(os.environ.get('EMAIL_BATCH_WAIT', 5))
+app.config['EMAIL_BATCH_DRAIN_INTERVAL'] = int(os.environ.get('EMAIL_BATCH_DRAIN_INTERVAL', 60))
+PENDING_EMAILS_KEY = 'pending_receipt_emails'
+BATCH_TASK_KEY = 'pending_receipt_emails_task'
+DRAIN_SCHEDULED_KEY = 'pending_receipt_emails_scheduled'
+FAILED_EMAILS_KEY = 'failed_receipt_emails'
+PROGRESS_CHANNEL = 'task_progress:{task_id}'
+FINAL_STATE_KEY = 'task_final_state:{task_id}'
 
-# Flask-Mail configuration
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 465
+# Flask-Mail configuration (e.g. MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_SSL=false for a local debug SMTP server)
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 465))
 app.config['MAIL_USE_TLS'] = False
-app.config['MAIL_USE_SSL'] = True
+app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL', 'true').lower() == 'true'
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = 'donation@receipt.com'
@@ -34,7 +70,7 @@ app.config['MAIL_DEFAULT_SENDER'] = 'donation@receipt.com'
 mail = Mail(app)
 
 # Initialize Logger
-logging.basicConfig(filename = 'app.log', format='%(asctime)s - %(message)s', level=logging.INFO)
+logging.basicConfig(filename = os.environ.get('LOG_FILE', 'app.log'), format='%(asctime)s - %(message)s', level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
@@ -43,10 +79,68 @@ users = {
 }
 
 
+# Verified credential cache configuration
+app.config['AUTH_CACHE_SIZE'] = int(os.environ.get('AUTH_CACHE_SIZE', 1024))
+app.config['AUTH_CACHE_TTL'] = int(os.environ.get('AUTH_CACHE_TTL', 60))
+
+
+class CredentialCache(object):
+    # Bounded, short-lived map of recently verified credentials so polling clients skip the slow password hash
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # per-process secret, the cached digests are useless outside this process
+        self.key = os.urandom(32)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def digest(self, username, password):
+        return hmac.new(self.key, '{}\0{}'.format(username, password).encode(), hashlib.sha256).digest()
+
+    def get(self, username, password, password_hash):
+        # True if these credentials were verified against this password hash less than ttl seconds ago
+        with self.lock:
+            entry = self.entries.get(username)
+        if entry is None:
+            return False
+        digest, cached_hash, expires = entry
+        # a changed entry in users invalidates the cached verification
+        if expires < time.monotonic() or cached_hash != password_hash:
+            with self.lock:
+                if self.entries.get(username) is entry:
+                    del self.entries[username]
+            return False
+        return hmac.compare_digest(digest, self.digest(username, password))
+
+    def put(self, username, password, password_hash):
+        if self.maxsize <= 0:
+            return
+        entry = (self.digest(username, password), password_hash, time.monotonic() + self.ttl)
+        with self.lock:
+            self.entries[username] = entry
+            self.entries.move_to_end(username)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+credential_cache = CredentialCache(app.config['AUTH_CACHE_SIZE'], app.config['AUTH_CACHE_TTL'])
+
+
 @auth.verify_password
 def verify_password(username, password):
-    if username in users and \
-            check_password_hash(users.get(username), password):
+    password_hash = users.get(username)
+    if password_hash is None:
+        return None
+    if credential_cache.get(username, password, password_hash):
+        return username
+    # only successful verifications are cached, wrong passwords always pay the full hash
+    if check_password_hash(password_hash, password):
+        credential_cache.put(username, password, password_hash)
         return username
 
 
@@ -58,17 +152,248 @@ def get_pdf_path():
     pass
 
 
-@celery.task(bind=True)
-def send_async_email(self, email_data):
-    # Background task to send an email with Flask-Mail
+receipt_attachment = None
+
+
+def get_receipt_attachment():
+    # Read the receipt once per worker instead of once per email
+    global receipt_attachment
+    if receipt_attachment is None:
+        with app.open_resource('receipts/example.jpg') as fp:
+            receipt_attachment = fp.read()
+    return receipt_attachment
+
+
+def create_message(email_data):
     msg = Message(subject=email_data['subject'],
                   sender=app.config['MAIL_DEFAULT_SENDER'],
                   recipients=[email_data['to']])
     msg.body = email_data['body']
-    with app.open_resource('receipts/example.jpg') as fp:
-        msg.attach('donation_receipt.jpeg', 'image/jpeg', fp.read())
+    msg.attach('donation_receipt.jpeg', 'image/jpeg', get_receipt_attachment())
+    return msg
+
+
+def publish_progress(task_id, state, meta):
+    message = dict(meta, state=state, task_id=task_id)
+    redis_client.publish(PROGRESS_CHANNEL.format(task_id=task_id), json.dumps(message))
+
+
+def store_final_state(task_id, state, meta):
+    # Fire-and-forget tasks leave no result, a short lived marker tells status checks and late streams that they ended
+    redis_client.set(FINAL_STATE_KEY.format(task_id=task_id), json.dumps(dict(meta, state=state)), ex=app.config['FINAL_STATE_TTL'])
+
+
+def report_progress(task, state, current, total, status):
+    # Store the progress in the result backend and push it to the watchers of the task
+    meta = {'current': current, 'total': total, 'status': status}
+    # fire-and-forget tasks keep no progress in Redis, it is only pushed to the watchers
+    if task.ignore_result:
+        if state != 'PROGRESS':
+            store_final_state(task.request.id, state, meta)
+    elif state == 'PROGRESS':
+        task.update_state(state=state, meta=meta)
+    publish_progress(task.request.id, state, meta)
+    return meta
+
+
+class ProgressTask(celery.Task):
+    # Tasks that report progress also tell their watchers when they fail, so the streams end
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        meta = {'current': 1, 'total': 1, 'status': str(exc)}
+        if self.ignore_result:
+            store_final_state(task_id, 'FAILURE', meta)
+        publish_progress(task_id, 'FAILURE', meta)
+
+
+@celery.task(bind=True, base=ProgressTask, ignore_result=app.config['EMAIL_IGNORE_RESULT'])
+def send_async_email(self, email_data):
+    # Background task to send an email with Flask-Mail
+    report_progress(self, 'PROGRESS', 0, 1, 'Sending...')
+    msg = create_message(email_data)
     with app.app_context():
         mail.send(msg)
+    return report_progress(self, 'SUCCESS', 1, 1, 'Email sent')
+
+
+def pop_pending_emails(count):
+    # Atomically take up to count pending emails
+    with redis_client.pipeline() as pipe:
+        pipe.lrange(PENDING_EMAILS_KEY, 0, count - 1)
+        pipe.ltrim(PENDING_EMAILS_KEY, count, -1)
+        emails, _ = pipe.execute()
+    return [json.loads(email) for email in emails]
+
+
+def requeue_emails(emails):
+    # Put unsent emails back at the head of the pending list, in their order
+    if emails:
+        redis_client.lpush(PENDING_EMAILS_KEY, *[json.dumps(email_data) for email_data in reversed(emails)])
+
+
+def schedule_drain():
+    # At most one drain is scheduled at a time, the flag expires in case its task is lost
+    expires = app.config['EMAIL_BATCH_WAIT'] + 600
+    if redis_client.set(DRAIN_SCHEDULED_KEY, 1, nx=True, ex=expires):
+        task = send_batch_emails.apply_async(countdown=app.config['EMAIL_BATCH_WAIT'])
+        redis_client.set(BATCH_TASK_KEY, task.id)
+        return task.id
+    return None
+
+
+def queue_email(email_data):
+    # The first pending email schedules a drain, later ones join its batch and watch the same task
+    redis_client.rpush(PENDING_EMAILS_KEY, json.dumps(email_data))
+    task_id = schedule_drain()
+    if task_id is None:
+        task_id = redis_client.get(BATCH_TASK_KEY)
+        task_id = task_id.decode() if task_id else None
+    return task_id
+
+
+# Errors of one message, the SMTP connection is still usable for the others
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def park_failed_email(email_data, exc):
+    # Refused emails would fail again on every retry, they are kept aside for a look instead
+    redis_client.rpush(FAILED_EMAILS_KEY, json.dumps({'email': email_data, 'error': str(exc)}))
+    log.warning('Could not send donation receipt to email: {email} ({error})'.format(email=email_data['to'], error=exc))
+
+
+def send_pending_emails(progress):
+    # Drains the pending emails in groups, each group over one SMTP connection, and returns how many were sent
+    sent = 0
+    done = 0
+    batch = pop_pending_emails(app.config['EMAIL_BATCH_SIZE'])
+    while batch:
+        total = done + len(batch) + redis_client.llen(PENDING_EMAILS_KEY)
+        batch_sent = sent
+        position = 0
+        try:
+            with app.app_context():
+                with mail.connect() as conn:
+                    for email_data in batch:
+                        try:
+                            conn.send(create_message(email_data))
+                            sent += 1
+                        except MESSAGE_ERRORS as exc:
+                            park_failed_email(email_data, exc)
+                        position += 1
+                        done += 1
+                        progress(done, total)
+        except Exception:
+            # connection errors: nothing popped is lost, the next drain sends what this one could not
+            requeue_emails(batch[position:])
+            raise
+        log.info('Sent {count} donation receipts'.format(count=sent - batch_sent))
+        batch = pop_pending_emails(app.config['EMAIL_BATCH_SIZE'])
+    return sent
+
+
+@celery.task(bind=True, base=ProgressTask, ignore_result=app.config['EMAIL_IGNORE_RESULT'], max_retries=3, default_retry_delay=30)
+def send_batch_emails(self):
+    # Background task to drain the pending emails
+    try:
+        sent = send_pending_emails(lambda done, total: report_progress(self, 'PROGRESS', done, total, 'Sending...'))
+    except Exception as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc)
+        # give up, the next queued email or the periodic drain schedules a new one
+        redis_client.delete(DRAIN_SCHEDULED_KEY)
+        raise
+    redis_client.delete(DRAIN_SCHEDULED_KEY)
+    # emails queued while this drain was finishing could not schedule their own
+    if redis_client.llen(PENDING_EMAILS_KEY):
+        schedule_drain()
+    result = report_progress(self, 'SUCCESS', sent, sent, 'Emails sent')
+    result['result'] = sent
+    return result
+
+
+@celery.task(ignore_result=True)
+def drain_pending_emails():
+    # Periodic safety net: schedules a drain for emails left pending after a drain gave up
+    if redis_client.llen(PENDING_EMAILS_KEY):
+        schedule_drain()
+
+
+if app.config['EMAIL_BATCH_ENABLED']:
+    celery.conf.beat_schedule = {
+        'drain-pending-emails': {
+            'task': drain_pending_emails.name,
+            'schedule': app.config['EMAIL_BATCH_DRAIN_INTERVAL'],
+        },
+    }
+
+
+class ProgressHub(object):
+    # One Redis pub/sub subscription per process, fanned out to every watcher of a task
+
+    def __init__(self, redis_client, retry_delay=1):
+        self.redis_client = redis_client
+        self.retry_delay = retry_delay
+        self.watchers = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        # (re)starts the listener, e.g. after it died or in a process forked after the first watch
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                pubsub = self.subscribe()
+                self.thread = threading.Thread(target=self.listen, args=(pubsub,), daemon=True)
+                self.thread.start()
+
+    def subscribe(self):
+        pubsub = self.redis_client.pubsub()
+        pubsub.psubscribe(PROGRESS_CHANNEL.format(task_id='*'))
+        # wait for the confirmation, so no update published after watch returns is missed
+        message = None
+        while message is None or message['type'] != 'psubscribe':
+            message = pubsub.get_message(timeout=1)
+        return pubsub
+
+    def listen(self, pubsub):
+        while True:
+            try:
+                for message in pubsub.listen():
+                    if message['type'] != 'pmessage':
+                        continue
+                    progress = json.loads(message['data'])
+                    with self.lock:
+                        watchers = list(self.watchers.get(progress['task_id'], ()))
+                    for watcher in watchers:
+                        watcher.put(progress)
+            except redis.RedisError as exc:
+                # updates missed until the new subscription are caught up by the streams' status checks
+                log.warning('Progress subscription lost ({error}), resubscribing'.format(error=exc))
+                pubsub.close()
+                pubsub = self.resubscribe()
+
+    def resubscribe(self):
+        while True:
+            time.sleep(self.retry_delay)
+            try:
+                return self.subscribe()
+            except redis.RedisError as exc:
+                log.warning('Could not resubscribe to progress updates ({error})'.format(error=exc))
+
+    def watch(self, task_id):
+        self.start()
+        watcher = queue.Queue()
+        with self.lock:
+            self.watchers.setdefault(task_id, []).append(watcher)
+        return watcher
+
+    def unwatch(self, task_id, watcher):
+        with self.lock:
+            self.watchers[task_id].remove(watcher)
+            if not self.watchers[task_id]:
+                del self.watchers[task_id]
+
+
+progress_hub = ProgressHub(redis_client)
 
 
 @app.route('/ping')
@@ -80,7 +405,7 @@ def ping():
 @auth.login_required
 def index():
     if request.method == 'GET':
-        return render_template('index.html', email=session.get('email', ''))
+        return render_template('index.html', email=session.get('email', ''), task_id=session.get('task_id'))
     email = request.form['email']
     session['email'] = email
 
@@ -90,17 +415,23 @@ def index():
         'to': email,
         'body': 'Thank you for your donation.'
     }
-    send_async_email.delay(email_data)
-    log.info('Sent donation receipt to email: {email}'.format(email=email_data['to']))
+    if app.config['EMAIL_BATCH_ENABLED']:
+        task_id = queue_email(email_data)
+    else:
+        task_id = send_async_email.delay(email_data).id
+    session['task_id'] = task_id
+    log.info('Sent donation receipt to email: {email} (task {task_id})'.format(email=email_data['to'], task_id=task_id))
 
     return redirect(url_for('index'))
 
 
-@app.route('/status/<task_id>')
-@auth.login_required
-def taskstatus(task_id):
-    task = send_async_email.AsyncResult(task_id)
-    if task.state == 'PENDING':
+def get_task_status(task_id):
+    task = celery.AsyncResult(task_id)
+    final_state = redis_client.get(FINAL_STATE_KEY.format(task_id=task_id)) if task.state == 'PENDING' else None
+    if final_state:
+        # a fire-and-forget task that ended, its result was not stored
+        response = json.loads(final_state)
+    elif task.state == 'PENDING':
         response = {
             'state': task.state,
             'current': 0,
@@ -124,7 +455,44 @@ def taskstatus(task_id):
             'total': 1,
             'status': str(task.info),  # this is the exception raised
         }
-    return jsonify(response)
+    return response
+
+
+@app.route('/status/<task_id>')
+@auth.login_required
+def taskstatus(task_id):
+    return jsonify(get_task_status(task_id))
+
+
+@app.route('/stream/<task_id>')
+@auth.login_required
+def taskstream(task_id):
+    # Server-Sent Events: the current status once, then every progress update pushed by the task
+    watcher = progress_hub.watch(task_id)
+
+    def events():
+        try:
+            progress = get_task_status(task_id)
+            while True:
+                yield 'data: {progress}\n\n'.format(progress=json.dumps(progress))
+                if progress['state'] in ('SUCCESS', 'FAILURE'):
+                    break
+                progress = None
+                while progress is None:
+                    try:
+                        progress = watcher.get(timeout=15)
+                    except queue.Empty:
+                        status = get_task_status(task_id)
+                        if status['state'] in ('SUCCESS', 'FAILURE'):
+                            # the final update was stored but not received, end the stream anyway
+                            progress = status
+                        else:
+                            # keep the connection open through proxies
+                            yield ': keep-alive\n\n'
+        finally:
+            progress_hub.unwatch(task_id, watcher)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,32 @@
+import argparse
+import base64
+import time
+
+from app import app, credential_cache
+
+
+def benchmark(requests, cache):
+    # Authenticated requests per second against the index page
+    credential_cache.clear()
+    credential_cache.maxsize = app.config['AUTH_CACHE_SIZE'] if cache else 0
+    credentials = base64.b64encode(b'mike:yee').decode()
+    headers = {'Authorization': 'Basic ' + credentials}
+
+    with app.test_client() as client:
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = client.get('/', headers=headers)
+            assert response.status_code == 200
+        elapsed = time.perf_counter() - start
+
+    return requests / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Authenticated requests per second with and without the credential cache')
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    for cache in (False, True):
+        print('{name:>8}: {rate:8.1f} requests/s'.format(
+            name='cached' if cache else 'uncached', rate=benchmark(args.requests, cache)))
@@ -0,0 +1,63 @@
+import argparse
+import time
+import uuid
+
+import fakeredis
+from celery.app.trace import build_tracer
+from celery.backends.redis import RedisBackend
+
+import app as app_module
+from app import app, celery
+
+
+def make_result(i, size):
+    # Task result with a large payload
+    return {'current': i, 'total': i, 'status': 'Emails sent', 'result': list(range(size))}
+
+
+@celery.task(bind=True)
+def finish(self, i, size):
+    # Ends like the email tasks: reports its final state, then returns its result
+    result = app_module.report_progress(self, 'SUCCESS', i, i, 'Emails sent')
+    return dict(result, result=list(range(size)))
+
+
+def run(name, serializer, expires, ignore_result, rounds, tasks, size, interval):
+    # Prints the keys and bytes kept in Redis after every round of finished tasks
+    backend = RedisBackend(app=celery, url=app.config['CELERY_RESULT_BACKEND'], serializer=serializer, expires=expires)
+    # local Redis stand-in, expires keys like a real server
+    backend.client = fakeredis.FakeRedis()
+    app_module.redis_client = backend.client
+    # tasks run through the worker's tracer, which skips storing the result of ignore_result tasks
+    finish.backend = backend
+    finish.ignore_result = ignore_result
+    trace = build_tracer(finish.name, finish, app=celery)
+
+    for step in range(1, rounds + 1):
+        for i in range(tasks):
+            task_id = str(uuid.uuid4())
+            trace(task_id, (i, size), {}, {'id': task_id})
+        time.sleep(interval)
+        keys = backend.client.keys('celery-task-meta-*') + backend.client.keys(app_module.FINAL_STATE_KEY.format(task_id='*'))
+        stored = sum(len(backend.client.get(key) or b'') for key in keys)
+        print(f'{name:>22} round {step}: {len(keys):6} keys, {stored / 1024:10.1f} KB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Redis memory growth of task results by result handling setting')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--tasks', type=int, default=1000, help='tasks finished per round')
+    parser.add_argument('--size', type=int, default=100, help='integers in each result')
+    parser.add_argument('--interval', type=float, default=1, help='seconds between rounds')
+    parser.add_argument('--ttl', type=int, default=2, help='result_expires of the expiring runs')
+    args = parser.parse_args()
+
+    for name, serializer, expires, ignore_result in (
+        # 0 disables expiry, None would fall back to the app's result_expires
+        ('json, no expiry', 'json', 0, False),
+        ('json, ttl', 'json', args.ttl, False),
+        ('msgpack, ttl', 'msgpack', args.ttl, False),
+        # only the final state marker is kept, for FINAL_STATE_TTL seconds
+        ('ignore_result', 'msgpack', args.ttl, True),
+    ):
+        run(name, serializer, expires, ignore_result, args.rounds, args.tasks, args.size, args.interval)
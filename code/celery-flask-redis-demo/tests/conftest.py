@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# app logs to a file at import time, keep it out of the working tree
+os.environ.setdefault('LOG_FILE', os.path.join(tempfile.mkdtemp(), 'app.log'))
@@ -0,0 +1,77 @@
+import json
+import smtplib
+
+import fakeredis
+from pytest import fixture, raises
+
+import app
+
+
+class FakeConnection(object):
+    # SMTP connection that refuses some recipients and drops after a number of messages
+
+    def __init__(self, refused=(), drop_after=None):
+        self.refused = refused
+        self.drop_after = drop_after
+        self.sent = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def send(self, message):
+        if self.drop_after is not None and len(self.sent) == self.drop_after:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        recipient = message.recipients[0]
+        if recipient in self.refused:
+            raise smtplib.SMTPRecipientsRefused({recipient: (550, b'No such user')})
+        self.sent.append(recipient)
+
+
+@fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(app, 'redis_client', client)
+    monkeypatch.setitem(app.app.config, 'EMAIL_BATCH_SIZE', 2)
+    return client
+
+
+def queue_emails(redis_client, recipients):
+    for recipient in recipients:
+        redis_client.rpush(app.PENDING_EMAILS_KEY, json.dumps({'subject': 'Donation Receipt', 'to': recipient, 'body': 'Thank you'}))
+
+
+def pending(redis_client):
+    return [json.loads(email)['to'] for email in redis_client.lrange(app.PENDING_EMAILS_KEY, 0, -1)]
+
+
+def test_refused_email_is_parked(redis_client, monkeypatch):
+    conn = FakeConnection(refused=('bad@example.com',))
+    monkeypatch.setattr(app.mail, 'connect', lambda: conn)
+    queue_emails(redis_client, ['a@example.com', 'bad@example.com', 'b@example.com'])
+    progress = []
+
+    sent = app.send_pending_emails(lambda done, total: progress.append((done, total)))
+
+    assert sent == 2
+    assert conn.sent == ['a@example.com', 'b@example.com']
+    assert pending(redis_client) == []
+    failed = [json.loads(email) for email in redis_client.lrange(app.FAILED_EMAILS_KEY, 0, -1)]
+    assert [email['email']['to'] for email in failed] == ['bad@example.com']
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+
+
+def test_unsent_emails_are_requeued_when_the_connection_drops(redis_client, monkeypatch):
+    conn = FakeConnection(drop_after=1)
+    monkeypatch.setattr(app.mail, 'connect', lambda: conn)
+    queue_emails(redis_client, ['a@example.com', 'b@example.com', 'c@example.com'])
+
+    with raises(smtplib.SMTPServerDisconnected):
+        app.send_pending_emails(lambda done, total: None)
+
+    assert conn.sent == ['a@example.com']
+    # the unsent email of the batch goes back ahead of the emails still pending
+    assert pending(redis_client) == ['b@example.com', 'c@example.com']
+    assert redis_client.llen(app.FAILED_EMAILS_KEY) == 0
@@ -0,0 +1,75 @@
+import json
+import queue
+import threading
+from types import SimpleNamespace
+
+import fakeredis
+import redis
+
+import app
+
+
+class LostPubSub(object):
+    # Subscription whose connection is gone
+
+    def listen(self):
+        raise redis.ConnectionError('Connection closed by server.')
+
+    def close(self):
+        pass
+
+
+def publish(client, task_id):
+    progress = {'state': 'PROGRESS', 'task_id': task_id, 'current': 1, 'total': 2, 'status': 'Sending...'}
+    client.publish(app.PROGRESS_CHANNEL.format(task_id=task_id), json.dumps(progress))
+    return progress
+
+
+def test_dead_listener_is_restarted():
+    client = fakeredis.FakeRedis()
+    hub = app.ProgressHub(client)
+    hub.thread = threading.Thread(target=lambda: None)
+    hub.thread.start()
+    hub.thread.join()
+
+    watcher = hub.watch('task-1')
+
+    assert hub.thread.is_alive()
+    progress = publish(client, 'task-1')
+    assert watcher.get(timeout=5) == progress
+
+
+def test_listener_resubscribes_after_connection_error():
+    client = fakeredis.FakeRedis()
+    hub = app.ProgressHub(client, retry_delay=0.01)
+    watcher = queue.Queue()
+    hub.watchers['task-1'] = [watcher]
+
+    threading.Thread(target=hub.listen, args=(LostPubSub(),), daemon=True).start()
+
+    # updates are received again once the listener has resubscribed
+    received = None
+    for _ in range(100):
+        progress = publish(client, 'task-1')
+        try:
+            received = watcher.get(timeout=0.05)
+            break
+        except queue.Empty:
+            pass
+    assert received == progress
+
+
+def test_fire_and_forget_task_leaves_its_final_state(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(app, 'redis_client', client)
+    # the result backend never heard of the task
+    monkeypatch.setattr(app.celery, 'AsyncResult', lambda task_id: SimpleNamespace(state='PENDING'))
+    task = SimpleNamespace(ignore_result=True, request=SimpleNamespace(id='task-1'))
+
+    assert app.get_task_status('task-1')['state'] == 'PENDING'
+    app.report_progress(task, 'PROGRESS', 0, 1, 'Sending...')
+    assert app.get_task_status('task-1')['state'] == 'PENDING'
+    app.report_progress(task, 'SUCCESS', 1, 1, 'Email sent')
+
+    assert app.get_task_status('task-1') == {'state': 'SUCCESS', 'current': 1, 'total': 1, 'status': 'Email sent'}
+    assert 0 < client.ttl(app.FINAL_STATE_KEY.format(task_id='task-1')) <= app.app.config['FINAL_STATE_TTL']
@@ -0,0 +1,57 @@
+# python -m proj.benchmark --count 2000 --chunk-sizes 1 10 100 1000
+import argparse
+import time
+
+from celery import group
+from celery.contrib.testing.worker import start_worker
+
+from proj.celery import app
+from proj.celeryconfig import A_QUEUE, M_QUEUE
+from proj.tasks import GatheredResult, add, add_many, split
+
+
+# the in-memory broker and result backend are polled, a short interval keeps the polling out of the timings
+POLL_INTERVAL = 0.005
+
+
+def run_single(count):
+    # One add task (and one broker round trip) per pair
+    results = [add.delay(i, i) for i in range(count)]
+    return [result.get(timeout=60, interval=POLL_INTERVAL) for result in results]
+
+
+def run_bulk(count, chunk_size):
+    # Chunks of add_many tasks gathered by the caller, as with rpc://: the chord callback of the
+    # in-memory result backend waits for the chunks in 0.5 second steps, which would dominate the timings
+    xs = list(range(count))
+    chunks = group(add_many.s(x_chunk, y_chunk) for x_chunk, y_chunk in split(xs, xs, chunk_size))
+    return GatheredResult(chunks()).get(timeout=60, interval=POLL_INTERVAL)
+
+
+def benchmark(count, chunk_sizes):
+    # Prints additions per second of single tasks and of the bulk API for several chunk sizes
+    runs = [('single', lambda: run_single(count))]
+    runs += [(f'chunk {chunk_size}', lambda chunk_size=chunk_size: run_bulk(count, chunk_size)) for chunk_size in chunk_sizes]
+
+    for name, run in runs:
+        start = time.perf_counter()
+        results = run()
+        elapsed = time.perf_counter() - start
+        assert results == [2 * i for i in range(count)]
+        print(f'{name:>10}: {count / elapsed:10.1f} tasks/s ({elapsed:.2f}s)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk add throughput (tasks/s) by chunk size, with an in-memory broker')
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+
+    # in-process worker, no RabbitMQ needed
+    app.conf.update(
+        broker_url='memory://',
+        result_backend='cache+memory://',
+        broker_transport_options={'polling_interval': POLL_INTERVAL},
+    )
+    with start_worker(app, pool='solo', queues=[A_QUEUE, M_QUEUE], perform_ping_check=False):
+        benchmark(args.count, args.chunk_sizes)
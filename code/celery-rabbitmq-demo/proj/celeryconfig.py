@@ -1,3 +1,5 @@
+import os
+
 # Iif you want to manually specify queue/exchange/binding key of Celery
 #from kombu import Queue, Exchange
 
@@ -8,8 +10,25 @@ M_QUEUE = 'mul_queue'
 
 
 # Broker settings
-broker_url = 'amqp://172.17.0.2'
-result_backend = 'rpc://'
+broker_url = os.environ.get('CELERY_BROKER_URL', 'amqp://172.17.0.2')
+# rpc:// replies only reach the caller and cannot run chords, the bulk API then gathers its chunks in the caller;
+# a backend that stores results, e.g. redis:// (pip install celery[redis]), runs the chord callback on a worker
+result_backend = os.environ.get('CELERY_RESULT_BACKEND', 'rpc://')
 imports = ['proj.tasks']
+
+# Result settings: stored results expire (redis and database backends),
+# CELERY_SERIALIZER=msgpack is more compact than json for large payloads (pip install celery[msgpack])
+result_expires = int(os.environ.get('CELERY_RESULT_EXPIRES', 3600))
+task_serializer = os.environ.get('CELERY_SERIALIZER', 'json')
+result_serializer = os.environ.get('CELERY_SERIALIZER', 'json')
+accept_content = ['json', 'msgpack']
+# fire-and-forget deployments can skip storing every result, tasks can still override it with ignore_result
+task_ignore_result = os.environ.get('CELERY_IGNORE_RESULT', 'false').lower() == 'true'
 #task_queues = (Queue(A_QUEUE, Exchange(A_QUEUE), routing_key=A_QUEUE), Queue(M_QUEUE, Exchange(M_QUEUE), routing_key=M_QUEUE))
-task_routes = {'proj.tasks.add': {'queue': A_QUEUE, 'routing_key': A_QUEUE}, 'proj.tasks.mul': {'queue': M_QUEUE, 'routing_key': M_QUEUE}}
+task_routes = {
+    'proj.tasks.add': {'queue': A_QUEUE, 'routing_key': A_QUEUE},
+    'proj.tasks.mul': {'queue': M_QUEUE, 'routing_key': M_QUEUE},
+    'proj.tasks.add_many': {'queue': A_QUEUE, 'routing_key': A_QUEUE},
+    'proj.tasks.mul_many': {'queue': M_QUEUE, 'routing_key': M_QUEUE},
+    'proj.tasks.collect': {'queue': A_QUEUE, 'routing_key': A_QUEUE},
+}
@@ -1,23 +1,22 @@
-from  proj.tasks import add, mul
+from  proj.tasks import add, mul, bulk_add, bulk_mul
 from proj.celeryconfig import A_QUEUE, M_QUEUE
-import time
 
 
 if __name__ == '__main__':
     add_result = add.apply_async((2, 2), queue=A_QUEUE)
-    # sleep 1 seconds to ensure the task has been finished
-    time.sleep(1)
-    # now the task should be finished and ready method will return True
-    print(f'add task finished? {add_result.ready()}')
-    print(f'add task result: {add_result.result}')
+    # wait for the result instead of sleeping a fixed time
+    print(f'add task result: {add_result.get(timeout=10)}')
 
     mul_result = mul.delay(3, 3)
     # at this time, our task is not finished, so it will return False
     print(f'mul task finished? {mul_result.ready()}')
-    print(f'mul task result: {mul_result.result}')
-    # sleep 10 seconds to ensure the task has been finished
-    time.sleep(10)
-    # now the task should be finished and ready method will return True
+    # block until the long running task has finished
+    print(f'mul task result: {mul_result.get(timeout=30)}')
     print(f'mul task finished? {mul_result.ready()}')
-    print(f'mul task result: {mul_result.result}')
-    
\ No newline at end of file
+
+    # bulk API: 1000 additions in 10 tasks, gathered by a chord callback (by the caller with rpc://)
+    xs = list(range(1000))
+    ys = list(range(1000))
+    print(f'bulk add results: {bulk_add(xs, ys, chunk_size=100).get(timeout=30)[:10]}...')
+    # 1000 multiplications in 4 long running tasks instead of 1000
+    print(f'bulk mul results: {bulk_mul(xs, ys, chunk_size=250).get(timeout=60)[:10]}...')
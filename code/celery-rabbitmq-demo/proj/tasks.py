@@ -1,8 +1,13 @@
+from celery import chord, group
 from proj.celery import app
 from proj.celeryconfig import A_QUEUE, M_QUEUE
 import time
 
 
+# Number of argument pairs computed by one task of the bulk API
+CHUNK_SIZE = 100
+
+
 @app.task(bind=True, name='proj.tasks.add', queue=A_QUEUE, default_retry_delay=1, max_retries=3)
 def add(self, x, y):
     try:
@@ -19,3 +24,74 @@ def mul(x, y):
     time.sleep(5)
     print(f'Long running task finished with result {x*y}')
     return x * y
+
+
+@app.task(bind=True, name='proj.tasks.add_many', queue=A_QUEUE, default_retry_delay=1, max_retries=3)
+def add_many(self, xs, ys):
+    # One task adds a whole chunk, so the broker round trip is paid once per chunk
+    try:
+        return [x + y for x, y in zip(xs, ys)]
+    except Exception as exc:
+        raise self.retry(exc=exc)
+
+
+@app.task(name='proj.tasks.mul_many', queue=M_QUEUE)
+def mul_many(xs, ys):
+    print(f'Long running task begins for {len(xs)} pairs')
+    # the 5 seconds of setup are paid once per chunk
+    time.sleep(5)
+    return [x * y for x, y in zip(xs, ys)]
+
+
+@app.task(name='proj.tasks.collect', queue=A_QUEUE)
+def collect(chunk_results):
+    # Chord callback: the chunk results in submission order, flattened
+    return [result for chunk in chunk_results for result in chunk]
+
+
+def split(xs, ys, chunk_size):
+    # Argument vectors in chunks of chunk_size pairs
+    if len(xs) != len(ys):
+        raise ValueError(f'{len(xs)} x values but {len(ys)} y values')
+    return [(xs[i:i + chunk_size], ys[i:i + chunk_size]) for i in range(0, len(xs), chunk_size)]
+
+
+class GatheredResult(object):
+    # Result of a group of chunk tasks, flattened by the caller like the chord callback would
+
+    def __init__(self, group_result):
+        self.group_result = group_result
+
+    def ready(self):
+        return self.group_result.ready()
+
+    def get(self, timeout=None, interval=0.5):
+        return collect(self.group_result.get(timeout=timeout, interval=interval))
+
+
+def supports_chords():
+    # rpc:// replies only reach the caller, so no worker can run a chord callback
+    try:
+        app.backend.ensure_chords_allowed()
+    except NotImplementedError:
+        return False
+    return True
+
+
+def bulk(task, xs, ys, chunk_size=CHUNK_SIZE):
+    # Fan the chunks out as a group and fan their results back in with a chord callback,
+    # or in the caller when the result backend has no chords
+    chunks = [task.s(x_chunk, y_chunk) for x_chunk, y_chunk in split(xs, ys, chunk_size)]
+    if not supports_chords():
+        return GatheredResult(group(chunks)())
+    return chord(chunks)(collect.s())
+
+
+def bulk_add(xs, ys, chunk_size=CHUNK_SIZE):
+    # AsyncResult of [x + y for x, y in zip(xs, ys)]
+    return bulk(add_many, xs, ys, chunk_size)
+
+
+def bulk_mul(xs, ys, chunk_size=CHUNK_SIZE):
+    # AsyncResult of [x * y for x, y in zip(xs, ys)]
+    return bulk(mul_many, xs, ys, chunk_size)
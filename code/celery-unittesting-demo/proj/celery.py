@@ -1,8 +1,10 @@
+import os
 from celery import Celery
 
 
 app = Celery('proj')
-app.config_from_object('proj.celeryconfig')
+# CELERY_CONFIG_MODULE=proj.celeryconfig_production selects the production queue profile
+app.config_from_object(os.environ.get('CELERY_CONFIG_MODULE', 'proj.celeryconfig'))
 
 
 if __name__ == '__main__':
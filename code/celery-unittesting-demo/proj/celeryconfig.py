@@ -1,3 +1,5 @@
+import os
+
 # Iif you want to manually specify queue/exchange/binding key of Celery
 #from kombu import Queue, Exchange
 
@@ -8,7 +10,17 @@ M_QUEUE = 'mul_queue'
 S_QUEUE = 'square_queue'
 
 # Broker settings
-broker_url = 'amqp://172.17.0.2'
-result_backend = 'rpc://'
+broker_url = os.environ.get('CELERY_BROKER_URL', 'amqp://172.17.0.2')
+# rpc:// keeps results as messages in the caller's reply queue, use e.g. redis:// to offload and expire them
+result_backend = os.environ.get('CELERY_RESULT_BACKEND', 'rpc://')
 imports = ['proj.tasks']
+
+# Result settings: stored results expire (redis and database backends),
+# CELERY_SERIALIZER=msgpack is more compact than json for large payloads (pip install celery[msgpack])
+result_expires = int(os.environ.get('CELERY_RESULT_EXPIRES', 3600))
+task_serializer = os.environ.get('CELERY_SERIALIZER', 'json')
+result_serializer = os.environ.get('CELERY_SERIALIZER', 'json')
+accept_content = ['json', 'msgpack']
+# fire-and-forget deployments can skip storing every result, tasks can still override it with ignore_result
+task_ignore_result = os.environ.get('CELERY_IGNORE_RESULT', 'false').lower() == 'true'
 task_routes = {'proj.tasks.add': {'queue': A_QUEUE, 'routing_key': A_QUEUE}, 'proj.tasks.mul': {'queue': M_QUEUE, 'routing_key': M_QUEUE}, 'proj.tasks.square': {'queue': S_QUEUE, 'routing_key': S_QUEUE}}
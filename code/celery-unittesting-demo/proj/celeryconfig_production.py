@@ -0,0 +1,26 @@
+# Production queue profile: CELERY_CONFIG_MODULE=proj.celeryconfig_production
+#
+# Run one worker pool per queue so slow mul tasks never hold up add (and square, which hands off to mul when
+# results are stored, e.g. CELERY_RESULT_BACKEND=redis://; with rpc:// it computes mul itself):
+#   celery -A proj worker -Q add_queue,square_queue -c 8 -n add@%h
+#   celery -A proj worker -Q mul_queue -c 4 -O fair -n mul@%h
+#
+# RabbitMQ does not change the arguments of an existing queue, delete add_queue/mul_queue/square_queue
+# before switching to this profile or declaring them with x-max-priority fails.
+from kombu import Queue, Exchange
+from proj.celeryconfig import *
+
+
+# Priority support: messages sent with apply_async(priority=0..9) jump ahead in their queue
+task_queue_max_priority = 10
+task_default_priority = 5
+task_queues = tuple(
+    Queue(name, Exchange(name), routing_key=name, queue_arguments={'x-max-priority': task_queue_max_priority})
+    for name in (A_QUEUE, M_QUEUE, S_QUEUE)
+)
+
+# Late acks and a prefetch of 1: a worker reserves one message per process, so idle workers get the next
+# long running task instead of it waiting behind another one in a busy worker's prefetch buffer
+task_acks_late = True
+task_reject_on_worker_lost = True
+worker_prefetch_multiplier = 1
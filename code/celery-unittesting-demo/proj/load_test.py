@@ -0,0 +1,41 @@
+# Start the workers of the profile under test, then: python -m proj.load_test --mul 200 --add 200
+import argparse
+import time
+
+from proj.tasks import add, mul
+
+
+def percentile(latencies, q):
+    # Nearest rank percentile in milliseconds
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] * 1000
+
+
+def load_test(mul_count, add_count, interval):
+    # Saturates the mul queue, then measures the submit to result latency of add tasks
+    mul_results = [mul.delay(i, i) for i in range(mul_count)]
+
+    latencies = []
+    for i in range(add_count):
+        start = time.perf_counter()
+        add.delay(i, i).get(timeout=300)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(interval)
+
+    print(f'add latency with {mul_count} mul tasks queued: '
+          f'p50 {percentile(latencies, 50):.1f} ms, '
+          f'p95 {percentile(latencies, 95):.1f} ms, '
+          f'p99 {percentile(latencies, 99):.1f} ms, '
+          f'max {max(latencies) * 1000:.1f} ms')
+    pending = sum(1 for result in mul_results if not result.ready())
+    print(f'mul tasks still pending: {pending}/{mul_count}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tail latency of add while mul is saturated')
+    parser.add_argument('--mul', type=int, default=200, help='mul tasks queued before measuring')
+    parser.add_argument('--add', type=int, default=200, help='add tasks measured')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between add tasks')
+    args = parser.parse_args()
+
+    load_test(args.mul, args.add, args.interval)
@@ -1,3 +1,4 @@
+from celery.backends.rpc import RPCBackend
 from proj.celery import app
 from proj.celeryconfig import A_QUEUE, M_QUEUE, S_QUEUE
 from time import sleep
@@ -11,15 +12,25 @@ def add(self, x, y):
         raise self.retry(exc=exc)
 
 
-@app.task(name='proj.tasks.mul', queue=M_QUEUE)
+# long running: acknowledge after it finished so a lost worker's message is redelivered
+@app.task(name='proj.tasks.mul', queue=M_QUEUE, acks_late=True)
 def mul(x, y):
     sleep(5)
     return x * y
 
 
+def replies_to_caller():
+    # rpc:// sends a result to the caller of the task only, a task that replaces it could not reply
+    return isinstance(app.backend, RPCBackend)
+
+
 @app.task(bind=True, name='proj.tasks.square', queue=S_QUEUE, default_retry_delay=1, max_retries=1)
 def square(self, x):
-    try:
-        return mul(x=x, y=x)
-    except Exception as exc:
-        raise self.retry(exc=exc)
+    if replies_to_caller():
+        try:
+            return mul(x=x, y=x)
+        except Exception as exc:
+            raise self.retry(exc=exc)
+    # hand the work to the mul queue instead of blocking this worker for 5 seconds,
+    # the result of square becomes the result of the replacing mul task
+    return self.replace(mul.s(x, x))
@@ -1,4 +1,4 @@
-from celery.exceptions import Retry
+from celery.exceptions import Ignore, Retry
 from pytest import raises
 from unittest.mock import patch
 from proj.tasks import add, square
@@ -12,13 +12,27 @@ class TestAddTask(object):
         assert add_result == 3
 
 
+    @patch('proj.tasks.replies_to_caller', return_value=True)
     @patch('proj.tasks.mul')
     @patch('proj.tasks.square.retry')
-    def test_square_retry(self, square_retry, mul):
+    def test_square_retry(self, square_retry, mul, replies_to_caller):
         # Set a side effect on the patched methods, so that they raise the errors we want.
         square_retry.side_effect = Retry()
         mul.side_effect = Exception()
 
         with raises(Retry):
             square(3)
-            mul.assert_called_with(3)
+        mul.assert_called_with(x=3, y=3)
+
+
+    @patch('proj.tasks.replies_to_caller', return_value=False)
+    @patch('proj.tasks.mul')
+    @patch('proj.tasks.square.retry')
+    def test_square_replaced_by_mul(self, square_retry, mul, replies_to_caller):
+        # With a result storing backend replace sends the mul task once and raises Ignore, which must not trigger a retry
+        with raises(Ignore):
+            square(3)
+
+        mul.s.assert_called_with(3, 3)
+        mul.s.return_value.delay.assert_called_once_with()
+        square_retry.assert_not_called()
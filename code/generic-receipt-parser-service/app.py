@@ -1,13 +1,106 @@
-from flask import abort, Flask, jsonify, request
+import atexit
+import json
+import os
+import resource
+import time
+
+from flask import abort, Flask, jsonify, request, Response, stream_with_context
 from flair.data import Sentence
 from flair.models import SequenceTagger
+import torch
+
+from batching import MicroBatcher
+from cache import LineCache
 
 
 app = Flask(__name__)
 
 
-# load the model
-model = SequenceTagger.load_from_file('best-model.pt')
+# threads used by torch for a forward pass, keep workers x threads <= cores
+torch.set_num_threads(int(os.environ.get('TORCH_THREADS', torch.get_num_threads())))
+
+# "eager" (full precision) or "quantized" (dynamic int8 quantization of the LSTM and linear layers)
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'eager')
+
+
+MODEL_PATH = 'best-model.pt'
+
+
+def load_model(backend):
+    """Loads the tagger for the given inference backend"""
+    tagger = SequenceTagger.load_from_file(MODEL_PATH)
+    tagger.eval()
+    if backend == 'quantized':
+        tagger = torch.quantization.quantize_dynamic(tagger, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+    elif backend != 'eager':
+        raise ValueError(f"Unknown model backend {backend}")
+
+    return tagger
+
+
+# load the model, once in the gunicorn master when the app is preloaded (see gunicorn.conf.py)
+start = time.perf_counter()
+model = load_model(MODEL_BACKEND)
+MODEL_LOAD_SECONDS = time.perf_counter() - start
+
+# number of lines per forward pass
+MINI_BATCH_SIZE = int(os.environ.get('MINI_BATCH_SIZE', 32))
+
+
+def predict_lines(lines, tagger=None):
+    """Predicts the NER tags of many lines in mini-batches and returns their dicts in the order of the lines"""
+    tagger = tagger or model
+    sentences = [Sentence(line) for line in lines]
+
+    # sort by length so each mini-batch holds sentences of similar length and needs less padding
+    by_length = sorted(sentences, key=len, reverse=True)
+    if by_length:
+        tagger.predict(by_length, mini_batch_size=MINI_BATCH_SIZE)
+
+    return [sentence.to_dict(tag_type='ner') for sentence in sentences]
+
+
+# share forward passes between concurrent requests
+MICRO_BATCHING = os.environ.get('MICRO_BATCHING', 'true').lower() == 'true'
+batcher = MicroBatcher(
+    predict_lines,
+    max_batch_size=int(os.environ.get('MAX_BATCH_SIZE', 64)),
+    max_wait_ms=float(os.environ.get('MAX_WAIT_MS', 5)),
+)
+
+
+def model_id(backend):
+    """Identifies the predictions of a backend and model file, a retrained or switched model invalidates saved caches"""
+    stat = os.stat(MODEL_PATH)
+    return f"{backend}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+# predictions of lines already seen, e.g. header, address and footer lines of the same merchant
+line_cache = LineCache(
+    maxsize=int(os.environ.get('LINE_CACHE_SIZE', 100000)),
+    path=os.environ.get('LINE_CACHE_PATH'),
+    model_id=model_id(MODEL_BACKEND),
+)
+# saved on exit of the development server, gunicorn saves it from its workers instead (see gunicorn.conf.py)
+atexit.register(line_cache.save)
+
+
+def predict(lines):
+    """Predicts lines missing from the line cache, through the micro-batcher when enabled"""
+    predictions = [line_cache.get(line) for line in lines]
+    missing = [index for index, prediction in enumerate(predictions) if prediction is None]
+
+    if missing:
+        missing_lines = [lines[index] for index in missing]
+        if MICRO_BATCHING:
+            missing_predictions = batcher.predict_lines(missing_lines)
+        else:
+            missing_predictions = predict_lines(missing_lines)
+        for index, line, prediction in zip(missing, missing_lines, missing_predictions):
+            line_cache.put(line, prediction)
+            predictions[index] = prediction
+
+    return predictions
 
 
 @app.route('/api/v1/ping')
@@ -16,29 +109,105 @@ def ping():
     return jsonify(response), 200
 
 
-@app.route('/api/v1/parseReceipt', methods=['POST'])
-def parseReceipt():
+def memory_usage():
+    """Returns the resident memory of this process in MB, pss counts pages shared with other workers proportionally"""
+    usage = {"max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    try:
+        with open('/proc/self/smaps_rollup') as fp:
+            for line in fp:
+                name, value = line.split(':', 1)
+                if name in ('Rss', 'Pss', 'Shared_Clean', 'Private_Dirty'):
+                    usage[f"{name.lower()}_mb"] = int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        # smaps_rollup is only available on Linux
+        pass
+
+    return usage
+
+
+@app.route('/api/v1/metrics')
+def metrics():
+    response = {
+        "pid": os.getpid(),
+        "model_backend": MODEL_BACKEND,
+        "model_load_seconds": MODEL_LOAD_SECONDS,
+        "torch_threads": torch.get_num_threads(),
+        "memory": memory_usage(),
+        "batching": batcher.metrics(),
+        "line_cache": line_cache.stats(),
+    }
+    return jsonify(response), 200
+
+
+def parse_receipt(receipt):
+    """Returns the predictions of the non-empty lines of a receipt keyed by LINE_{index}"""
     response_list = list()
 
+    # keep the index of every non-empty line
+    lines = [(index, line) for index, line in enumerate(receipt.split('\n')) if line.strip()]
+
+    # predict tags of all the lines at once
+    predictions = predict([line for _, line in lines])
+
+    # add predictions to response
+    for (index, _), prediction in zip(lines, predictions):
+        response_list.append({f"LINE_{index}": prediction})
+
+    return response_list
+
+
+@app.route('/api/v1/parseReceipt', methods=['POST'])
+def parseReceipt():
     if not request.json or not 'receipt' in request.json:
         abort(400)
     receipt = request.json['receipt']
 
-    # create a sentences
-    lines = receipt.split('\n')
-    for index, line in enumerate(lines):
+    response = parse_receipt(receipt)
+    return jsonify(response), 200
+
+
+# yielded in place of a line that is not valid JSON, so one bad line does not end the stream
+INVALID_JSON = object()
+
+
+def read_ndjson(stream):
+    """Yields the JSON value of every non-empty line of a stream, or INVALID_JSON"""
+    for line in stream:
         if line.strip():
-            sentence = Sentence(line)
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield INVALID_JSON
 
-            # predict tags and print
-            model.predict(sentence)
 
-            # add prediction to response
-            response_list.append({f"LINE_{index}": sentence.to_dict(tag_type='ner')})
+@app.route('/api/v1/parseReceipts', methods=['POST'])
+def parseReceipts():
+    # NDJSON uploads are read line by line, JSON arrays are parsed at once
+    if request.mimetype == 'application/x-ndjson':
+        receipts = read_ndjson(request.stream)
+    elif isinstance(request.json, list):
+        receipts = request.json
+    else:
+        abort(400)
 
-    print(response_list)
-    response = response_list
-    return jsonify(response), 200
+    def generate():
+        for position, item in enumerate(receipts):
+            # every item is a receipt string or a {"receipt": ...} object, an optional "id" is echoed back
+            result = {"index": position}
+            if isinstance(item, dict):
+                if 'id' in item:
+                    result['id'] = item['id']
+                item = item.get('receipt')
+            if item is INVALID_JSON:
+                result['error'] = 'Invalid JSON'
+            elif isinstance(item, str):
+                result['result'] = parse_receipt(item)
+            else:
+                result['error'] = 'Missing receipt'
+            yield json.dumps(result) + '\n'
+
+    # results are sent as soon as every receipt is parsed
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 if __name__ == "__main__":
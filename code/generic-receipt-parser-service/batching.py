@@ -0,0 +1,82 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+
+class MicroBatcher:
+    """Queues lines from concurrent requests and predicts them together once a batch is full or has waited long enough"""
+
+    def __init__(self, predict, max_batch_size=64, max_wait_ms=5):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.batches = 0
+        self.lines = 0
+        self.last_batch_size = 0
+        self.max_queue_depth = 0
+
+    def start(self):
+        """Starts the scheduler thread, lazily so it also runs in workers forked after the import"""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def submit(self, lines):
+        """Queues lines and returns a future per line"""
+        self.start()
+        futures = []
+        for line in lines:
+            future = Future()
+            self.queue.put((line, future))
+            futures.append(future)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+        return futures
+
+    def predict_lines(self, lines):
+        """Predicts lines through the shared batches and returns the results in the order of the lines"""
+        return [future.result() for future in self.submit(lines)]
+
+    def next_batch(self):
+        """Blocks for the first line, then collects lines until the batch is full or the wait time is over"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+        """Predicts batches forever and routes every result back to its future"""
+        while True:
+            batch = self.next_batch()
+            try:
+                results = self.predict([line for line, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            self.batches += 1
+            self.lines += len(batch)
+            self.last_batch_size = len(batch)
+
+    def metrics(self):
+        """Returns the queue depth and batch size metrics"""
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "lines": self.lines,
+            "average_batch_size": self.lines / self.batches if self.batches else 0,
+            "last_batch_size": self.last_batch_size,
+        }
@@ -0,0 +1,126 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import random
+import time
+
+from flair.data import Sentence
+import numpy as np
+
+from app import MODEL_BACKEND, batcher, load_model, model, predict_lines
+
+
+LINES = [
+    "123 My Street",
+    "Springfield, CA 12345",
+    "Store #888 02/25/19 10:10am",
+    "1 COFFEE LARGE 3.49",
+    "2 BAGEL EVERYTHING W/ CREAM CHEESE 5.98",
+    "SUBTOTAL 9.47",
+    "TAX 8.25% 0.78",
+    "TOTAL 10.25",
+    "VISA ************1234",
+    "THANK YOU FOR SHOPPING WITH US",
+]
+
+
+def make_receipt(lines, seed=0):
+    """Returns a receipt of the given number of lines"""
+    rng = random.Random(seed)
+
+    return [rng.choice(LINES) for _ in range(lines)]
+
+
+def predict_per_line(lines):
+    """Predicts the NER tags one line (forward pass) at a time"""
+    results = []
+    for line in lines:
+        sentence = Sentence(line)
+        model.predict(sentence)
+        results.append(sentence.to_dict(tag_type='ner'))
+
+    return results
+
+
+def benchmark(sizes, repeats):
+    """Prints the lines/s of the per-line and the batched prediction for receipts of several sizes"""
+    # warm up
+    predict_lines(make_receipt(10))
+
+    for size in sizes:
+        receipt = make_receipt(size)
+        for name, predict in (("per-line", predict_per_line), ("batched", predict_lines)):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                predict(receipt)
+            elapsed = time.perf_counter() - start
+            print(f"{size:>4} lines {name:>9}: {elapsed / repeats * 1000:8.1f} ms/receipt, {size * repeats / elapsed:8.1f} lines/s")
+
+
+def timed(predict, receipt):
+    """Returns the latency of one prediction"""
+    start = time.perf_counter()
+    predict(receipt)
+    return time.perf_counter() - start
+
+
+def benchmark_concurrent(requests, concurrency, lines):
+    """Prints requests/s and p50/p99 latency of concurrent requests predicted on their own and micro-batched"""
+    receipts = [make_receipt(lines, seed) for seed in range(requests)]
+
+    for name, predict in (("per-request", predict_lines), ("micro-batched", batcher.predict_lines)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = list(executor.map(lambda receipt: timed(predict, receipt), receipts))
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:>13}: {requests / elapsed:8.1f} requests/s, "
+            f"p50 {np.percentile(latencies, 50) * 1000:.1f} ms, p99 {np.percentile(latencies, 99) * 1000:.1f} ms"
+        )
+    print(f"batching: {batcher.metrics()}")
+
+
+def entities(prediction):
+    """Returns the (start, end, type) of every entity of a prediction"""
+    return {(entity['start_pos'], entity['end_pos'], entity['type']) for entity in prediction['entities']}
+
+
+def benchmark_backends(requests, lines):
+    """Prints the latency of the eager and quantized backends and how many entities the quantized backend keeps"""
+    receipts = [make_receipt(lines, seed) for seed in range(requests)]
+    taggers = {
+        'eager': model if MODEL_BACKEND == 'eager' else load_model('eager'),
+        'quantized': model if MODEL_BACKEND == 'quantized' else load_model('quantized'),
+    }
+    predictions = {}
+
+    for name, tagger in taggers.items():
+        predict_lines(receipts[0], tagger)
+        start = time.perf_counter()
+        predictions[name] = [predict_lines(receipt, tagger) for receipt in receipts]
+        elapsed = time.perf_counter() - start
+        print(f"{name:>9}: {elapsed / requests * 1000:8.1f} ms/receipt")
+
+    expected = [entities(prediction) for receipt in predictions['eager'] for prediction in receipt]
+    actual = [entities(prediction) for receipt in predictions['quantized'] for prediction in receipt]
+    same_lines = sum(1 for e, a in zip(expected, actual) if e == a)
+    kept = sum(len(e & a) for e, a in zip(expected, actual))
+    total = sum(len(e) for e in expected)
+    print(f"parity: {same_lines}/{len(expected)} identical lines, {kept}/{total} entities kept")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receipt parsing throughput on CPU")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=0, help="Run concurrent requests instead (micro-batching)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--backends", action="store_true", help="Compare the eager and quantized backends instead")
+    args = parser.parse_args()
+
+    if args.backends:
+        benchmark_backends(args.requests, args.lines)
+    elif args.concurrency:
+        benchmark_concurrent(args.requests, args.concurrency, args.lines)
+    else:
+        benchmark(args.sizes, args.repeats)
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import fcntl
+import json
+import os
+import tempfile
+import threading
+
+
+class LineCache:
+    """Bounded LRU cache from receipt line text to its prediction, optionally persisted to a JSON file"""
+
+    def __init__(self, maxsize=100000, path=None, model_id=None):
+        self.maxsize = maxsize
+        self.path = path
+        # predictions are only valid for the model that made them, a file saved by another model is discarded
+        self.model_id = model_id
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def key(line):
+        """Returns the cache key of a line, trailing whitespace does not change the prediction"""
+        return line.rstrip()
+
+    def get(self, line):
+        """Returns the cached prediction of a line or None"""
+        key = self.key(line)
+        with self.lock:
+            prediction = self.entries.get(key)
+            if prediction is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return prediction
+
+    def put(self, line, prediction):
+        """Caches the prediction of a line, evicting the least recently used lines above maxsize"""
+        if self.maxsize <= 0:
+            return
+        key = self.key(line)
+        with self.lock:
+            self.entries[key] = prediction
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def read(self):
+        """Returns the entries saved in the cache file, none when they were saved for another model"""
+        with open(self.path) as fp:
+            saved = json.load(fp)
+        if saved.get('model_id') != self.model_id:
+            print(f"Discarding line cache {self.path}, saved for model {saved.get('model_id')} instead of {self.model_id}")
+            return OrderedDict()
+
+        return OrderedDict((line, prediction) for line, prediction in saved['entries'])
+
+    def load(self):
+        """Loads the cache from its file"""
+        entries = self.read()
+        with self.lock:
+            self.entries = OrderedDict(list(entries.items())[-self.maxsize:])
+
+    def save(self):
+        """Saves the cache to its file, merged with the lines saved by other workers and replaced atomically"""
+        if not self.path:
+            return
+        with self.lock:
+            entries = OrderedDict(self.entries)
+        with open(f'{self.path}.lock', 'w') as lock:
+            # one worker at a time reads, merges and replaces the file
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = self.read() if os.path.exists(self.path) else OrderedDict()
+            # the lines of this process are the most recently used ones
+            for key, prediction in entries.items():
+                merged[key] = prediction
+                merged.move_to_end(key)
+            saved = {'model_id': self.model_id, 'entries': list(merged.items())[-self.maxsize:]}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as fp:
+                json.dump(saved, fp)
+            os.replace(fp.name, self.path)
+
+    def stats(self):
+        """Returns the cache counters and hit ratio"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0,
+        }
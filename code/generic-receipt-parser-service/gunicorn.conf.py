@@ -0,0 +1,53 @@
+import gc
+import os
+import time
+
+
+# gunicorn -c gunicorn.conf.py app:app
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WORKERS', os.cpu_count() or 1))
+# threads let concurrent requests of a worker share micro-batches
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 8))
+# load the app (and the model) once in the master, workers share the weights copy-on-write
+preload_app = True
+timeout = int(os.environ.get('TIMEOUT', 120))
+
+TORCH_THREADS = int(os.environ.get('TORCH_THREADS', max(1, (os.cpu_count() or 1) // workers)))
+started = time.perf_counter()
+
+
+def rss_mb():
+    """Returns the resident memory of this process in MB"""
+    with open('/proc/self/statm') as fp:
+        return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def when_ready(server):
+    import atexit
+    from app import MODEL_LOAD_SECONDS, line_cache
+
+    # the master serves no requests, saving its start up copy of the line cache on exit would drop the workers' lines
+    atexit.unregister(line_cache.save)
+
+    # objects created so far are never collected, so the garbage collector does not touch (and copy) their pages
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    server.log.info(
+        f"Master ready in {time.perf_counter() - started:.1f}s (model loaded in {MODEL_LOAD_SECONDS:.1f}s), "
+        f"rss {rss_mb():.0f} MB, {workers} workers x {TORCH_THREADS} torch threads"
+    )
+
+
+def post_fork(server, worker):
+    import torch
+
+    torch.set_num_threads(TORCH_THREADS)
+    server.log.info(f"Worker {worker.pid} forked, rss {rss_mb():.0f} MB (mostly shared with the master)")
+
+
+def worker_exit(server, worker):
+    from app import line_cache
+
+    line_cache.save()
+    server.log.info(f"Worker {worker.pid} saved the line cache: {line_cache.stats()}")
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_results_are_routed_to_their_lines():
+    batch_sizes = []
+
+    def predict(lines):
+        batch_sizes.append(len(lines))
+        return [line.upper() for line in lines]
+
+    batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=20)
+    requests = [[f'receipt {receipt} line {line}' for line in range(3)] for receipt in range(5)]
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(executor.map(batcher.predict_lines, requests))
+
+    assert results == [[line.upper() for line in lines] for lines in requests]
+    assert sum(batch_sizes) == 15
+    assert max(batch_sizes) <= 4
+    assert batcher.metrics()['lines'] == 15
+
+
+def test_errors_are_raised_by_every_line_of_the_batch():
+    def predict(lines):
+        raise RuntimeError('model failed')
+
+    batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=1)
+
+    with pytest.raises(RuntimeError, match='model failed'):
+        batcher.predict_lines(['Coffee 2.50', 'Bagel 3.00'])
@@ -0,0 +1,56 @@
+import json
+
+from cache import LineCache
+
+
+def test_least_recently_used_line_is_evicted():
+    cache = LineCache(maxsize=2)
+    cache.put('Coffee 2.50', {'entities': ['coffee']})
+    cache.put('Bagel 3.00', {'entities': ['bagel']})
+    assert cache.get('Coffee 2.50 ') == {'entities': ['coffee']}
+
+    cache.put('Tax 0.50', {'entities': ['tax']})
+
+    assert cache.get('Bagel 3.00') is None
+    assert cache.get('Coffee 2.50') == {'entities': ['coffee']}
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test_save_merges_the_lines_of_every_worker(tmp_path):
+    path = str(tmp_path / 'line_cache.json')
+    first = LineCache(maxsize=3, path=path, model_id='eager:1')
+    second = LineCache(maxsize=3, path=path, model_id='eager:1')
+    first.put('Coffee 2.50', {'entities': ['coffee']})
+    first.put('Bagel 3.00', {'entities': ['bagel']})
+    second.put('Tax 0.50', {'entities': ['tax']})
+    second.put('Total 6.00', {'entities': ['total']})
+
+    first.save()
+    second.save()
+
+    with open(path) as fp:
+        saved = json.load(fp)
+    assert saved['model_id'] == 'eager:1'
+    # the latest lines are kept up to maxsize
+    assert [line for line, _ in saved['entries']] == ['Bagel 3.00', 'Tax 0.50', 'Total 6.00']
+    loaded = LineCache(maxsize=3, path=path, model_id='eager:1')
+    assert loaded.get('Total 6.00') == {'entities': ['total']}
+    assert loaded.get('Coffee 2.50') is None
+
+
+def test_cache_of_another_model_is_discarded(tmp_path):
+    path = str(tmp_path / 'line_cache.json')
+    eager = LineCache(maxsize=3, path=path, model_id='eager:1')
+    eager.put('Coffee 2.50', {'entities': ['coffee']})
+    eager.save()
+
+    quantized = LineCache(maxsize=3, path=path, model_id='quantized:1')
+    assert quantized.get('Coffee 2.50') is None
+
+    quantized.put('Bagel 3.00', {'entities': ['bagel']})
+    quantized.save()
+    with open(path) as fp:
+        saved = json.load(fp)
+    assert saved == {'model_id': 'quantized:1', 'entries': [['Bagel 3.00', {'entities': ['bagel']}]]}